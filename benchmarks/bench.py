@@ -0,0 +1,117 @@
+"""
+bench - benchmark typescore on a synthetic corpus of packages, offline
+
+Usage:
+  bench.py [options]
+  bench.py --help
+
+Options:
+  --count <n>           Number of synthetic packages. [default: 20]
+  --seed <seed>         Seed for generating the corpus. [default: 0]
+  --corpus <folder>     Keep the corpus wheels in this folder.
+  --unpack              Score unpacked wheels instead of installing them.
+  -j, --jobs <n>        Number of packages to score in parallel. [default: 1]
+  --repeat <n>          Number of runs; the fastest one is reported. [default: 1]
+  --save-baseline <file>  Save the results to this file as the baseline.
+  --baseline <file>     Compare the results with this baseline, and fail if
+                        they are worse by more than the tolerance.
+  --tolerance <pct>     How much slower than the baseline is allowed,
+                        in percent. [default: 20]
+  -h, --help            Show this help.
+
+The corpus is generated from the seed, so the same options always benchmark
+the same packages. It is scored from a local wheelhouse, so there is no
+network access; packages are installed into a fresh virtualenv (one per
+worker with --jobs) rather than the one running the benchmark.
+
+The baseline is specific to the machine it was saved on, so save one
+before making a change and compare with it afterwards on the same machine.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from docopt import docopt
+from corpus import make_corpus
+from typescore.typescore import compute_scores, use_environment
+
+
+# Ignore phase p95 changes smaller than this; they are just noise.
+MIN_SECONDS = 0.05
+
+
+def run_once(names: list[str], wheelhouse: str, unpack: bool, jobs: int, workdir: str) -> dict:
+    """ Score the corpus and get the throughput and per-phase latencies. """
+    profile = os.path.join(workdir, 'profile.json')
+    scores = os.path.join(workdir, 'scores.csv')
+    start = time.perf_counter()
+    compute_scores(names, None, scores, verbose=False, jobs=jobs, wheelhouse=wheelhouse,
+                   unpack=unpack, profile=profile)
+    elapsed = time.perf_counter() - start
+    with open(profile) as f:
+        phases = json.load(f)['phases']
+    return {
+        'packages': len(names),
+        'elapsed': elapsed,
+        'packages_per_hour': len(names) * 3600 / elapsed,
+        'phases': {phase: {'p50': t['p50'], 'p95': t['p95']} for phase, t in phases.items()},
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """ Get the ways in which result is worse than baseline by more than tolerance percent. """
+    regressions = []
+    allowed = 1 + tolerance / 100
+    if result['packages_per_hour'] * allowed < baseline['packages_per_hour']:
+        regressions.append(f'packages/hour dropped from {baseline["packages_per_hour"]:.0f} '
+                           f'to {result["packages_per_hour"]:.0f}')
+    for phase, t in baseline['phases'].items():
+        now = result['phases'].get(phase, {}).get('p95', 0.0)
+        if now > t['p95'] * allowed and now - t['p95'] > MIN_SECONDS:
+            regressions.append(f'{phase} p95 went up from {t["p95"]:.2f}s to {now:.2f}s')
+    return regressions
+
+
+def main():
+    arguments = docopt(__doc__)
+    count = int(arguments['--count'])
+    seed = int(arguments['--seed'])
+    unpack = arguments['--unpack']
+    jobs = int(arguments['--jobs'])
+    repeat = int(arguments['--repeat'])
+
+    with tempfile.TemporaryDirectory(prefix='typescore-bench-') as workdir:
+        wheelhouse = arguments['--corpus'] or os.path.join(workdir, 'wheels')
+        names = make_corpus(wheelhouse, count, seed)
+        if jobs == 1 and not unpack:
+            # Don't install the corpus into the environment running the benchmark.
+            venv = os.path.join(workdir, 'venv')
+            subprocess.run([sys.executable, '-m', 'venv', venv], capture_output=True, check=True)
+            use_environment(os.path.join(venv, 'Scripts' if sys.platform == 'win32' else 'bin', 'python'))
+        runs = [run_once(names, wheelhouse, unpack, jobs, workdir) for _ in range(repeat)]
+
+    result = min(runs, key=lambda r: r['elapsed'])
+    result['settings'] = {'count': count, 'seed': seed, 'unpack': unpack, 'jobs': jobs}
+    print(f'{result["packages_per_hour"]:.0f} packages/hour '
+          f'({count} packages in {result["elapsed"]:.1f}s)', file=sys.stderr)
+
+    if arguments['--save-baseline']:
+        with open(arguments['--save-baseline'], 'w') as f:
+            json.dump(result, f, indent=2)
+    if arguments['--baseline']:
+        with open(arguments['--baseline']) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != result['settings']:
+            print('Warning: the baseline was run with different settings', file=sys.stderr)
+        regressions = compare(result, baseline, float(arguments['--tolerance']))
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+""" Generate a corpus of synthetic wheels for benchmarking typescore.
+
+The corpus is deterministic for a given size and seed, and covers the kinds of
+package layout that typescore handles differently: regular packages (with and
+without py.typed, and with varying size and annotation density), single-file
+modules, namespace packages, packages with several top-level modules, and
+native-only modules that just have a stub next to the extension.
+"""
+
+import base64
+import hashlib
+import os
+import random
+import zipfile
+
+
+KINDS = ['package', 'single', 'namespace', 'multi', 'native']
+
+
+def _function(rng: random.Random, name: str, annotated: bool, method: bool=False) -> str:
+    nargs = rng.randint(0, 4)
+    indent = '    ' if method else ''
+    args = ['self'] if method else []
+    if annotated:
+        args += [f'a{i}: int' for i in range(nargs)]
+        return (f'{indent}def {name}({", ".join(args)}) -> int:\n'
+                f'{indent}    """ {name} """\n{indent}    return {nargs}\n')
+    args += [f'a{i}' for i in range(nargs)]
+    return f'{indent}def {name}({", ".join(args)}):\n{indent}    return {nargs}\n'
+
+
+def _module(rng: random.Random, size: int, density: float) -> str:
+    """ Make the source of a module with size functions and classes, of which
+        about density are annotated.
+    """
+    parts = []
+    for i in range(size):
+        annotated = rng.random() < density
+        if rng.random() < 0.3:
+            parts.append(f'class C{i}:\n')
+            for j in range(rng.randint(1, 4)):
+                parts.append(_function(rng, f'm{j}', annotated, method=True))
+        else:
+            parts.append(_function(rng, f'f{i}', annotated))
+    return '\n\n'.join(parts)
+
+
+def _package_files(rng: random.Random, kind: str, name: str) -> tuple[dict[str, str|bytes], list[str]]:
+    """ Get the files of a synthetic package (path -> contents) and its top-level modules. """
+    module = name.replace('-', '_')
+    size = rng.choice([5, 20, 80])
+    density = rng.choice([0.0, 0.5, 0.9, 1.0])
+    files: dict[str, str|bytes] = {}
+    if kind == 'package':
+        files[f'{module}/__init__.py'] = _module(rng, size, density)
+        for i in range(rng.randint(0, 3)):
+            files[f'{module}/sub{i}.py'] = _module(rng, size, density)
+        if density == 1.0:
+            files[f'{module}/py.typed'] = ''
+        return files, [module]
+    if kind == 'single':
+        files[f'{module}.py'] = _module(rng, size, density)
+        return files, [module]
+    if kind == 'namespace':
+        # Named like google-cloud-storage; the google folder has no __init__.py.
+        part = name.split('-', 1)[1].replace('-', '_')
+        files[f'benchns/{part}/__init__.py'] = _module(rng, size, density)
+        return files, ['benchns']
+    if kind == 'multi':
+        for suffix in ('', '_extras'):
+            files[f'{module}{suffix}/__init__.py'] = _module(rng, size, density)
+        return files, [module, f'{module}_extras']
+    # native: just a (fake) extension module and its stub
+    files[f'{module}.abi3.so'] = bytes(rng.getrandbits(8) for _ in range(256))
+    files[f'{module}.pyi'] = _module(rng, size, 1.0)
+    return files, [module]
+
+
+def _record_line(path: str, data: bytes) -> str:
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode()
+    return f'{path},sha256={digest},{len(data)}'
+
+
+def write_wheel(dest: str, name: str, version: str, files: dict[str, str|bytes], toplevels: list[str]) -> str:
+    """ Write a pure Python wheel for name containing files to the dest folder. Returns its path. """
+    dist = f'{name.replace("-", "_")}-{version}'
+    files = dict(files)
+    files[f'{dist}.dist-info/METADATA'] = (f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n'
+                                           f'Summary: Synthetic benchmark package {name}\n')
+    files[f'{dist}.dist-info/WHEEL'] = ('Wheel-Version: 1.0\nGenerator: typescore-benchmarks\n'
+                                        'Root-Is-Purelib: true\nTag: py3-none-any\n')
+    files[f'{dist}.dist-info/top_level.txt'] = ''.join(f'{t}\n' for t in toplevels)
+    path = os.path.join(dest, f'{dist}-py3-none-any.whl')
+    record = []
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for fname, contents in sorted(files.items()):
+            data = contents.encode() if isinstance(contents, str) else contents
+            # A fixed date so the same corpus gives byte-identical wheels.
+            zf.writestr(zipfile.ZipInfo(fname, date_time=(2020, 1, 1, 0, 0, 0)), data)
+            record.append(_record_line(fname, data))
+        record.append(f'{dist}.dist-info/RECORD,,')
+        zf.writestr(zipfile.ZipInfo(f'{dist}.dist-info/RECORD', date_time=(2020, 1, 1, 0, 0, 0)),
+                    '\n'.join(record) + '\n')
+    return path
+
+
+def make_corpus(dest: str, count: int=20, seed: int=0) -> list[str]:
+    """ Write count synthetic wheels to the dest folder, cycling through the
+        kinds of package, and return the names of the packages.
+    """
+    os.makedirs(dest, exist_ok=True)
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        kind = KINDS[i % len(KINDS)]
+        name = f'benchns-part{i}' if kind == 'namespace' else f'bench-{kind}{i}'
+        files, toplevels = _package_files(rng, kind, name)
+        write_wheel(dest, name, '1.0', files, toplevels)
+        names.append(name)
+    return names
@@ -2,14 +2,54 @@
 typescore - generate typing completeness scores (and more) for a set of packages
 
 Usage:
-  typescore [--packages <packages>] [--scores <scorefile>] [--sep <sep>] [--verbose] [<package>...]
+  typescore fetch [options] [<package>...]
+  typescore report [options] <results> <report>
+  typescore merge [options] <shard>...
+  typescore serve [options]
+  typescore [options] [<package>...]
   typescore --help
   typescore --version
 
 Options:
   --packages <packages> File containing the list of packages.
-  --scores <scorefile>  The output file (if not stdout).
+  --scores <scorefile>  The output file (if not stdout), or several
+                        comma-separated files.
   --sep <sep>           CSV column separator. [default: ,]
+  -j, --jobs <n>        Number of packages to score in parallel. [default: 1]
+  --cache <cachedir>    Cache scores in this folder and reuse them for
+                        package versions that have already been scored.
+  --wheelhouse <wheelhouse>  Install packages only from the wheels in this
+                        folder, without using the package index.
+  --unpack              Unpack wheels into a temporary folder to score them
+                        instead of installing the packages.
+  --with-deps           With --unpack, unpack dependencies' wheels too.
+  --resolve-ttl <seconds>  How long the package versions pip resolved to
+                        are trusted for in the cache (by default 0, or
+                        300 for typescore serve).
+  --journal <journal>   Record each package in this file as it is finished.
+  --resume              Carry on from where the run that wrote the journal
+                        stopped, instead of starting again.
+  --typeshed <typeshed> A local typeshed checkout to look for stubs in.
+  --stubs-index <url>   The PyPI JSON API (.../pypi) or simple API (.../simple)
+                        to look for stub packages in. [default: https://pypi.org/pypi]
+  --profile <profile>   Write how long each phase took for each package to
+                        this file as JSON.
+  --shard <k/n>         Score only the packages in the k'th of n shards.
+  --batch <n>           Install up to n packages that share dependencies
+                        together. [default: 1]
+  --prefetch <n>        How many packages to get ready ahead of the one
+                        being scored. [default: 2]
+  --timeout <seconds>   Stop analyzing a module after this many seconds.
+  --memory-limit <mb>   Stop analyzing a module if pyright needs more than
+                        this many megabytes of heap.
+  --memory-budget <mb>  With --jobs, only start another package while the
+                        memory pyright is expected to need for all the
+                        running ones stays under this many megabytes.
+  --extra-columns <names>  Comma-separated names for the extra columns
+                        in a report.
+  --host <host>         Address for typescore serve to listen on.
+                        [default: 127.0.0.1]
+  --port <port>         Port for typescore serve to listen on. [default: 8765]
   -v, --verbose         Include package info in the output.
   -h, --help            Show this help.
   -V, --version         Show the version.
@@ -19,6 +59,84 @@ packages. It reads this list from <packages> and writes the results to
 <scorefile>. If errors prevent it from scoring a package it will set the
 score to 0%.
 
+With --jobs, each parallel worker installs packages into its own
+virtualenv, so the environment typescore runs in is left alone. The
+packages expected to take longest are started first, so that a big one
+doesn't hold up the end of the run: with --cache, that goes by how long
+each package took last time, and otherwise by the size of its wheel in
+the --wheelhouse. The results are still written in input order.
+The modules of a package are analyzed in parallel, with each worker
+running at most its share of the CPUs' worth of pyright processes.
+
+The peak memory pyright needed for each package is kept in the --cache
+too, and with --memory-budget the workers are only given packages while
+the expected total fits in the budget. A package that doesn't fit is
+passed over for smaller ones that do, so many small packages can run
+alongside a big one; one that needs more than the whole budget runs on
+its own. Packages not scored before are expected to need the median of
+those that were.
+
+With --cache, scores are kept in a SQLite database in <cachedir>, keyed
+on the package version and pyright version. A package is only installed
+and scored again if pip would now install a different version of it, or
+pyright has been updated.
+
+The version pip resolves each package to is cached as well. With
+the --resolve-ttl option, it is trusted for that many seconds rather
+than asking pip again each run (so a new release isn't seen until then). When every package
+asked for can be answered from the cache this way, typescore doesn't ask
+pip, look at the installed packages or start pyright, so a run that is all
+cache hits takes a fraction of a second.
+
+'typescore fetch' (which needs --wheelhouse) downloads wheels for the packages and all their
+dependencies into <wheelhouse>, building wheels from source where needed.
+A later run with --wheelhouse then installs from there without any
+network access, apart from looking for stub packages with --verbose.
+
+With --unpack, nothing is installed with pip: each package's wheel is
+unpacked into a temporary folder (that is deleted afterwards) and scored
+from there. Without --with-deps, imports from the package's dependencies
+are resolved only from what is already installed, which may lower its
+score. If there is no --wheelhouse, wheels are downloaded or built with
+'pip wheel' for each package.
+
+A long run can be made resumable with --journal. If the run dies, running
+the same command again with --resume skips the packages in the journal
+and writes the complete score file, using the journal for the results of
+the skipped packages.
+
+With --verbose, typescore looks for stubs for each package in typeshed
+(on GitHub, or in the --typeshed checkout) and for '<package>-stubs' and
+'types-<package>' packages on PyPI (or the --stubs-index mirror).
+With --cache, the answers are reused for a day.
+
+At the end of a run, typescore writes a summary of where the time went to
+stderr: the total, median and 95th percentile time of each phase (resolve,
+cache, install, metadata, stubs, analyze, cleanup), the time spent
+resolving dependencies to plan --batch groups, and the slowest
+packages. --profile writes the full timings as JSON.
+
+Without --jobs or --batch, the next --prefetch packages are got ready
+while one is being analyzed: their versions are resolved, their wheels
+downloaded (or unpacked) and their stubs looked up, so that waiting on the
+network overlaps with pyright's work. Installing, analyzing and cleaning
+up still happen one package at a time, and the output order is the same.
+
+With --batch, typescore first asks pip what each package would install,
+and groups packages that share dependencies (such as boto3, botocore and
+s3transfer) and agree on their versions. Each group is installed at once,
+its packages are scored, and then it is cleaned up, rather than the shared
+dependencies being installed and removed for every package. If pip can't
+install a group together, its packages are installed one at a time. Note
+that a package may score differently when an optional dependency of it
+happens to be installed for another package in its group.
+
+A module whose analysis goes over --timeout or --memory-limit has its pyright
+process killed, and gets a score of timeout or oom rather than 0%, so
+that one pathological package doesn't hold up the run and is easy to spot.
+A module that pyright couldn't be run on, or that it gave no report for,
+gets a score of failed. These results are not cached.
+
 The output has the form:
 
     package,typed,module,score,extra_columns
@@ -29,6 +147,41 @@ or, if --verbose is specified:
 
 'typed' is a Boolean and tells whether the package had a py.typed file.
 
+Each score file gets the same results. The format goes by the file's
+extension: .jsonl gets a JSON object per line, .db or .sqlite gets a
+SQLite database with a scores table, and .parquet gets a Parquet file
+(which needs pyarrow). These always have all of the columns, with the
+extra columns as a list. Anything else gets CSV as above.
+
+To spread a run over several machines, give each one the same --packages
+file and a different --shard from 1/n to n/n. The packages are
+split up by a hash of their names, so no coordination is needed. Then
+typescore merge with the same --packages puts the shards' score files
+back together into --scores in the original order. It uses the first
+result for a package that is in more than one shard, skips shard files
+that are missing, and lists the packages that have no results.
+
+typescore report renders a score file (in any of these formats) as a
+markdown report with a section for each package, or as HTML if <report>
+ends in .html. Each section is marked with a digest of its results, so
+rendering into an existing report only redoes the sections of packages
+whose results changed.
+
+typescore serve runs a local HTTP service that scores packages on
+request, so that many CI jobs can share one install and pyright cycle per
+package. GET /score/<package> (or /score/<package>/<version>) returns the
+package's scores as JSON, with a 404 status and the reason in error if it
+couldn't be scored, or a 400 status if the package name or version isn't
+valid; GET /health says how many packages are queued. Packages are scored
+one at a time, and a request for a package version that is already queued
+waits for that result instead of scoring it again. Results are kept in
+memory, and in the --cache if given. The installing options
+(--wheelhouse, --unpack, --timeout and so on) apply as for scoring. Which
+version pip picks for a package is remembered for --resolve-ttl seconds,
+five minutes by default, so asking again within that time is answered at
+once, without running pip; after it, pip is asked again so that new
+releases are picked up.
+
 Note: we only score top-level modules, not submodules. The assumption is
 that scores for top-level modules would be reasonably representative of
 the packages all-up.
@@ -42,16 +195,67 @@ might be the package rank on PyPI downloads.
 __version__ = '0.11'
 
 
+import sys
 from docopt import docopt
-from .typescore import compute_scores
+from .api import score_package, score_package_async, score_packages, score_packages_async
+from .merge import merge_scores
+from .report import write_report
+from .results import ModuleScore, PackageScores, TypeCompleteness
+from .typescore import compute_scores, configure, parse_line, parse_shard, read_packages
+from .wheelhouse import fetch_wheels
 
 
 def main():
     arguments = docopt(__doc__, version=__version__)
     packages = arguments['<package>']
     packagesfile = arguments['--packages']
-    scores = arguments['--scores']
+    scores = arguments['--scores'].split(',') if arguments['--scores'] else None
     verbose = arguments['--verbose']
     sep = arguments['--sep']
-    compute_scores(packages, packagesfile, scores, verbose, sep)
+    wheelhouse = arguments['--wheelhouse']
+    if arguments['fetch']:
+        if not wheelhouse:
+            sys.exit('typescore fetch needs --wheelhouse')
+        names = [parse_line(line, sep)[0] for line in read_packages(packages, packagesfile)]
+        fetch_wheels(names, wheelhouse)
+        return
+    if arguments['merge']:
+        merge_scores(arguments['<shard>'], packagesfile, scores, verbose, sep)
+        return
+    if arguments['report']:
+        extra_names = arguments['--extra-columns'].split(',') if arguments['--extra-columns'] else []
+        rendered, total = write_report(arguments['<results>'], arguments['<report>'], sep, extra_names)
+        print(f'Rendered {rendered} of {total} package sections', file=sys.stderr)
+        return
+    jobs = int(arguments['--jobs'])
+    cachedir = arguments['--cache']
+    unpack = arguments['--unpack']
+    unpack_deps = arguments['--with-deps']
+    journal = arguments['--journal']
+    resume = arguments['--resume']
+    if resume and not journal:
+        sys.exit('--resume needs --journal')
+    typeshed = arguments['--typeshed']
+    stubs_index = arguments['--stubs-index']
+    profile = arguments['--profile']
+    try:
+        shard = parse_shard(arguments['--shard']) if arguments['--shard'] else None
+    except ValueError:
+        sys.exit('--shard should be k/n, with k from 1 to n')
+    timeout = float(arguments['--timeout']) if arguments['--timeout'] else None
+    memory_limit = int(arguments['--memory-limit']) if arguments['--memory-limit'] else None
+    memory_budget = int(arguments['--memory-budget']) if arguments['--memory-budget'] else None
+    resolve_ttl = float(arguments['--resolve-ttl']) if arguments['--resolve-ttl'] else None
+    if arguments['serve']:
+        from .serve import DEFAULT_RESOLVE_TTL, serve
+        if resolve_ttl is None:
+            resolve_ttl = DEFAULT_RESOLVE_TTL
+        configure(wheelhouse, unpack, unpack_deps, typeshed, stubs_index, cachedir, timeout, memory_limit,
+                  resolve_ttl)
+        serve(arguments['--host'], int(arguments['--port']), cachedir, verbose, resolve_ttl)
+        return
+    compute_scores(packages, packagesfile, scores, verbose, sep, jobs, cachedir, wheelhouse,
+                   unpack, unpack_deps, journal, resume, typeshed, stubs_index, profile,
+                   timeout, memory_limit, shard, int(arguments['--batch']), int(arguments['--prefetch']),
+                   memory_budget, resolve_ttl or 0.0)
 
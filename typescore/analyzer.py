@@ -0,0 +1,305 @@
+import glob
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from importlib.util import find_spec
+from .results import Diagnostic, SymbolCounts, TypeCompleteness
+
+
+def pyright_version() -> str:
+    """ Get the version of pyright that the pyright wrapper package will run. """
+    forced = os.environ.get('PYRIGHT_PYTHON_FORCE_VERSION')
+    if forced and forced != 'latest':
+        return forced.lstrip('v')
+    # Going by the name of its dist-info folder is much quicker than importing
+    # importlib.metadata, which matters when all the scores come from the cache.
+    spec = find_spec('pyright')
+    if spec is not None and spec.submodule_search_locations:
+        site = os.path.dirname(spec.submodule_search_locations[0])
+        found = glob.glob(os.path.join(glob.escape(site), 'pyright-*.dist-info'))
+        if len(found) == 1:
+            return os.path.basename(found[0])[len('pyright-'):-len('.dist-info')]
+    from importlib.metadata import version
+    return version('pyright')
+
+
+def find_pyright() -> list[str]:
+    """ Get the command line for starting pyright. The pyright package on PyPI is
+        a wrapper that starts a Python interpreter and checks the node and pyright
+        installs before it launches node on every run. Where we can find an
+        installed copy of the right version, we launch node on it directly instead.
+    """
+    fallback = [sys.executable, "-m", "pyright"]
+    node = shutil.which('node')
+    spec = find_spec('pyright')
+    if node is None or spec is None or not spec.submodule_search_locations:
+        return fallback
+    ver = pyright_version()
+    cache = os.environ.get('PYRIGHT_PYTHON_CACHE_DIR') or \
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    candidates = [os.path.join(spec.submodule_search_locations[0], 'dist'),
+                  os.path.join(cache, 'pyright-python', ver, 'node_modules', 'pyright')]
+    for candidate in candidates:
+        try:
+            with open(os.path.join(candidate, 'package.json')) as f:
+                if json.load(f).get('version') != ver:
+                    continue
+        except (OSError, ValueError):
+            continue
+        script = os.path.join(candidate, 'index.js')
+        if os.path.exists(script):
+            return [node, script]
+    return fallback
+
+
+def _symbol_counts(counts: dict) -> SymbolCounts:
+    return SymbolCounts(counts.get('withKnownType', 0), counts.get('withAmbiguousType', 0),
+                        counts.get('withUnknownType', 0))
+
+
+def parse_report(module: str, output: str) -> TypeCompleteness:
+    """ Parse the output of pyright --verifytypes --outputjson. """
+    try:
+        report = json.loads(output)
+    except ValueError:
+        return TypeCompleteness(module, error='No JSON report found', status='failed')
+    diagnostics = [Diagnostic(d.get('severity', ''), d.get('message', ''), d.get('file', ''))
+                   for d in report.get('generalDiagnostics', [])]
+    tc = report.get('typeCompleteness')
+    if tc is None:
+        return TypeCompleteness(module, pyright_version=report.get('version', ''),
+                                diagnostics=diagnostics, error='No type completeness report found',
+                                status='failed')
+    errors = [d.message for d in diagnostics if d.severity == 'error']
+    return TypeCompleteness(
+        module,
+        score=tc.get('completenessScore', 0.0),
+        exported=_symbol_counts(tc.get('exportedSymbolCounts', {})),
+        other=_symbol_counts(tc.get('otherSymbolCounts', {})),
+        missing_function_docstrings=tc.get('missingFunctionDocStringCount', 0),
+        missing_class_docstrings=tc.get('missingClassDocStringCount', 0),
+        missing_default_params=tc.get('missingDefaultParamCount', 0),
+        files_analyzed=report.get('summary', {}).get('filesAnalyzed', 0),
+        pyright_version=report.get('version', ''),
+        diagnostics=diagnostics,
+        error='; '.join(errors) if errors else None)
+
+
+def _link(src: str, dst: str) -> None:
+    """ Symlink dst to src, or copy src if we can't make symlinks. """
+    try:
+        os.symlink(src, dst, target_is_directory=os.path.isdir(src))
+    except OSError:
+        if os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+
+def make_overlay(site_packages: str, subpath: str, overlay: str) -> bool:
+    """ Make a module from site_packages appear in the overlay folder as a folder
+        with a py.typed file, which pyright needs before it will verify types.
+        The files themselves are linked to, not copied or changed. A single-file
+        module (or the stub of a native one) becomes the __init__ of a package.
+        Returns False if the module can't be found.
+    """
+    src = f'{site_packages}/{subpath}'
+    single = f'{site_packages}/{subpath.replace("-", "_")}.py'
+    if not os.path.exists(single):
+        single += 'i'  # A stub for a native module
+    if not os.path.isdir(src) and not os.path.exists(single):
+        return False
+    dst = f'{overlay}/{subpath}'
+    os.makedirs(dst)
+    # Parent folders of a namespace module need to shadow the same
+    # regular packages that they would in site_packages.
+    parent = os.path.dirname(subpath)
+    while parent:
+        for init in ('__init__.py', '__init__.pyi'):
+            if os.path.exists(f'{site_packages}/{parent}/{init}'):
+                _link(f'{site_packages}/{parent}/{init}', f'{overlay}/{parent}/{init}')
+        parent = os.path.dirname(parent)
+    if os.path.isdir(src):
+        for entry in os.listdir(src):
+            _link(f'{src}/{entry}', f'{dst}/{entry}')
+    else:
+        _link(single, f'{dst}/__init__{os.path.splitext(single)[1]}')
+    if not os.path.exists(f'{dst}/py.typed'):
+        with open(f'{dst}/py.typed', 'w') as f:
+            pass
+    return True
+
+
+def _kill(proc: subprocess.Popen) -> None:
+    """ Kill a pyright process along with any processes it started. """
+    try:
+        if sys.platform == 'win32':
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    proc.wait()
+
+
+def _out_of_memory(proc: subprocess.Popen, stderr: str) -> bool:
+    """ Tell whether a pyright process that failed did so because it ran out of memory. """
+    if 'heap out of memory' in stderr or 'Allocation failed' in stderr:
+        return True
+    # node aborts when it can't get memory, and the kernel's OOM killer sends SIGKILL.
+    return proc.returncode in (-signal.SIGABRT, 134) or (sys.platform != 'win32' and
+                                                          proc.returncode == -signal.SIGKILL)
+
+
+def _wait(proc: subprocess.Popen, deadline: float|None) -> float|None:
+    """ Wait for a pyright process to finish, until deadline (a time.perf_counter()
+        value) if there is one. Returns the peak resident memory of the process
+        and the processes it waited for, in megabytes, or 0.0 where the platform
+        can't tell us; or None if the process was still running at the deadline.
+        We poll with wait4 rather than letting Popen wait, as that is what gets
+        us the resource usage of the process.
+    """
+    if not hasattr(os, 'wait4'):
+        try:
+            proc.wait(None if deadline is None else max(0.0, deadline - time.perf_counter()))
+        except subprocess.TimeoutExpired:
+            return None
+        return 0.0
+    delay = 0.01
+    while True:
+        pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux, but in bytes on macOS.
+            return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        time.sleep(delay if deadline is None else max(0.0, min(delay, deadline - time.perf_counter())))
+        delay = min(delay * 2, 0.1)
+
+
+class Analyzer:
+    """ Runs pyright for a scoring run. One of these is started per compute_scores
+        run (or per worker process), and works out how to launch pyright once, so
+        that each request only pays for pyright itself. Requests are independent,
+        and never change the folder the package is installed in: each one analyzes
+        the package through an overlay folder that is removed before it returns.
+    """
+
+    def __init__(self, python: str = sys.executable, timeout: float|None=None,
+                 memory_limit: int|None=None, max_procs: int|None=None):
+        """ python is the interpreter for the environment packages are scored in.
+            pyright finds the import search paths by running the first python on
+            the PATH, so we make sure that is this one.
+            timeout - the most seconds to let pyright spend on a module
+            memory_limit - the most megabytes of heap to let pyright use for a module
+            max_procs - the most pyright processes to run at once for a package
+                (by default, the number of CPUs)
+        """
+        self.command = find_pyright()
+        self.timeout = timeout
+        self.max_procs = max_procs or os.cpu_count() or 1
+        self.env = dict(os.environ)
+        self.env['PATH'] = os.path.dirname(python) + os.pathsep + self.env.get('PATH', '')
+        if memory_limit:
+            node_options = self.env.get('NODE_OPTIONS', '')
+            self.env['NODE_OPTIONS'] = f'{node_options} --max-old-space-size={memory_limit}'.strip()
+        self.version = ''
+        try:
+            # This also makes sure any first-time download of node or pyright
+            # happens now, rather than inside the first package's analysis.
+            s = subprocess.run(self.command + ['--version'], capture_output=True, text=True, env=self.env)
+            self.version = s.stdout.strip().split(' ')[-1]
+        except Exception as e:
+            print(f'Could not start pyright: {e}', file=sys.stderr)
+        if not self.version and self.command[0] != sys.executable:
+            # Go back to letting the wrapper sort it out.
+            self.command = [sys.executable, "-m", "pyright"]
+
+    def analyze(self, package: str, site_packages: str, subpaths: list[str],
+                search_path: str|None=None) -> dict[str, TypeCompleteness]:
+        """ Get type coverage scores for several top-level modules of a package at
+            once. pyright only verifies one module per run, so we make an overlay
+            for all the modules up front (see make_overlay), run pyright on them
+            concurrently, up to max_procs at a time, and then clean up. The time
+            limit for a module counts from when its pyright is started. Returns a
+            dictionary mapping
+            subpath to pyright's report. A module that goes over the time or
+            memory limit has its pyright killed, and gets a report with a status
+            of 'timeout' or 'oom'. Each report has the peak memory its pyright
+            used (see _wait).
+            package - package name part of the folder under site-packages where dist-info is found
+            site_packages - the folder the package is installed in
+            subpaths - module paths under site_packages
+            search_path - a folder to put ahead of the environment's site-packages
+                when resolving imports
+        """
+        overlay = tempfile.mkdtemp(prefix='typescore-overlay-')
+        env = dict(self.env)
+        paths = [overlay, search_path, env.get('PYTHONPATH')]
+        env['PYTHONPATH'] = os.pathsep.join(p for p in paths if p)
+        procs = {}
+        outputs = {}
+        reports = {}
+        started = {}
+        try:
+            todo = []
+            for subpath in subpaths:
+                if make_overlay(site_packages, subpath, overlay):
+                    todo.append(subpath)
+                else:
+                    reports[subpath] = TypeCompleteness(subpath.replace('/', '.'), error='Module not found')
+            while todo or procs:
+                while todo and len(procs) < self.max_procs:
+                    subpath = todo.pop(0)
+                    module = subpath.replace('/', '.')
+                    # The output goes to files, as we don't read it until pyright is done.
+                    outputs[subpath] = (tempfile.TemporaryFile('w+'), tempfile.TemporaryFile('w+'))
+                    try:
+                        # In a new session, so that we can kill everything it starts.
+                        procs[subpath] = subprocess.Popen(self.command + ["--verifytypes", module, "--outputjson"],
+                                                          stdout=outputs[subpath][0], stderr=outputs[subpath][1],
+                                                          text=True, env=env,
+                                                          start_new_session=sys.platform != 'win32')
+                        started[subpath] = time.perf_counter()
+                    except Exception as e:
+                        reports[subpath] = TypeCompleteness(module, error=str(e), status='failed')
+                for subpath, proc in list(procs.items()):
+                    module = subpath.replace('/', '.')
+                    peak = _wait(proc, time.perf_counter())  # Just see whether it has finished
+                    elapsed = time.perf_counter() - started[subpath]
+                    if peak is None:
+                        if not self.timeout or elapsed < self.timeout:
+                            continue
+                        _kill(proc)
+                        reports[subpath] = TypeCompleteness(module, error=f'Timed out after {self.timeout}s',
+                                                            status='timeout')
+                    else:
+                        stdout, stderr = outputs[subpath]
+                        stdout.seek(0)
+                        stderr.seek(0)
+                        reports[subpath] = parse_report(module, stdout.read())
+                        if proc.returncode not in (0, 1) and _out_of_memory(proc, stderr.read()):
+                            reports[subpath] = TypeCompleteness(module, error='Ran out of memory', status='oom')
+                        reports[subpath].peak_mb = peak
+                    reports[subpath].seconds = elapsed
+                    del procs[subpath]
+                if procs:
+                    time.sleep(0.05)
+        finally:
+            for proc in procs.values():
+                if proc.poll() is None:
+                    _kill(proc)
+            for stdout, stderr in outputs.values():
+                stdout.close()
+                stderr.close()
+            shutil.rmtree(overlay, ignore_errors=True)
+        for subpath, report in reports.items():
+            if report.error:
+                print(f'{package}/{report.module}: Scoring failed: {report.error}', file=sys.stderr)
+        return reports
@@ -0,0 +1,105 @@
+import tempfile
+import threading
+from typing import AsyncIterator, Iterable, Iterator
+from .analyzer import pyright_version
+from .cache import ResultCache
+from .results import PackageScores
+from .typescore import (_init_worker, _score_one_in_worker, configure, discard_prepared, get_skiplist,
+                        make_analyzer, prepare_package, score_prepared)
+
+
+# Held while packages are being scored in this process (jobs of 1), as they
+# are all installed into and removed from the same environment, and the
+# settings are shared (see configure).
+_scoring = threading.Lock()
+
+
+def score_packages(packages: Iterable[str], *, jobs: int=1, prefetch: int=2, stubs: bool=True,
+                   cachedir: str|None=None, wheelhouse: str|None=None, unpack: bool=False,
+                   unpack_deps: bool=False, typeshed: str|None=None, stubs_index: str|None=None,
+                   timeout: float|None=None, memory_limit: int|None=None,
+                   in_order: bool=True) -> Iterator[PackageScores]:
+    """ Score packages, yielding a PackageScores for each of them, in the order
+        given, or as each is finished if in_order is false. A package that
+        couldn't be scored gets a result with the reason in its error.
+
+        If stubs is true, typeshed and PyPI are checked for stub packages.
+        The other options are as for compute_scores. With jobs of 1, packages
+        are installed into the environment typescore is running in, and
+        removed again afterwards; with more, each worker process uses its
+        own virtualenv.
+
+        With jobs of 1, calls take turns: one that starts while another is
+        scoring waits until that one has finished (or been closed).
+    """
+    names = list(packages)
+    settings = dict(wheelhouse=wheelhouse, unpack=unpack, unpack_deps=unpack_deps,
+                    typeshed=typeshed, stubs_index=stubs_index, cachedir=cachedir,
+                    timeout=timeout, memory_limit=memory_limit)
+
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with tempfile.TemporaryDirectory(prefix='typescore-') as workdir, \
+             ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(workdir, settings, jobs)) as executor:
+            futures = [executor.submit(_score_one_in_worker, name, stubs) for name in names]
+            try:
+                for future in futures if in_order else as_completed(futures):
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+        return
+
+    # Not an RLock, as the async variants resume the generator on other threads.
+    with _scoring:
+        configure(**settings)
+        skiplist = get_skiplist()
+        analyzer = make_analyzer()
+        pyright = analyzer.version or pyright_version()
+        cache = ResultCache(cachedir) if cachedir else None
+        try:
+            prepare = lambda name: prepare_package(name, '', stubs, skiplist, pyright, cache, fetch=prefetch > 0)
+            finish = lambda prepared: score_prepared(prepared, skiplist, analyzer, cache)
+            if prefetch > 0:
+                from .pipeline import pipelined
+                yield from pipelined(names, prepare, finish, prefetch, discard_prepared)
+            else:
+                for name in names:
+                    yield finish(prepare(name))
+        finally:
+            if cache:
+                cache.close()
+
+
+def score_package(package: str, **options) -> PackageScores:
+    """ Score a single package. The options are as for score_packages. """
+    results = score_packages([package], **options)
+    try:
+        return next(results)
+    finally:
+        results.close()
+
+
+async def score_packages_async(packages: Iterable[str], *, in_order: bool=False,
+                               **options) -> AsyncIterator[PackageScores]:
+    """ Score packages without blocking the event loop, yielding a PackageScores
+        for each of them as it is finished (or in the order given, if in_order
+        is true). The options are as for score_packages.
+    """
+    import asyncio
+    results = score_packages(packages, in_order=in_order, **options)
+    done = object()
+    try:
+        while (result := await asyncio.to_thread(next, results, done)) is not done:
+            yield result
+    finally:
+        await asyncio.to_thread(results.close)
+
+
+async def score_package_async(package: str, **options) -> PackageScores:
+    """ Score a single package without blocking the event loop. The options are
+        as for score_packages.
+    """
+    import asyncio
+    return await asyncio.to_thread(score_package, package, **options)
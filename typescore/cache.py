@@ -0,0 +1,135 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+from .results import ModuleScore, PackageScores, TypeCompleteness
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS packages (
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    pyright TEXT NOT NULL,
+    stubs TEXT,
+    description TEXT NOT NULL,
+    scored_at REAL NOT NULL,
+    PRIMARY KEY (package, version, pyright)
+);
+CREATE TABLE IF NOT EXISTS modules (
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    pyright TEXT NOT NULL,
+    module TEXT NOT NULL,
+    typed INTEGER NOT NULL,
+    score TEXT NOT NULL,
+    metadata TEXT,
+    PRIMARY KEY (package, version, pyright, module)
+);
+CREATE TABLE IF NOT EXISTS durations (
+    package TEXT PRIMARY KEY,
+    seconds REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resolutions (
+    package TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    resolved_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memory (
+    package TEXT PRIMARY KEY,
+    peak_mb REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+'''
+
+
+class ResultCache:
+    """ An on-disk cache of scores, keyed on the normalized package name, the
+        installed package version, and the pyright version. A package is only
+        rescored when one of those changes.
+    """
+
+    def __init__(self, cachedir: str):
+        os.makedirs(cachedir, exist_ok=True)
+        # Worker processes each open their own connection, so allow for
+        # some waiting on each other's writes. Within a process the
+        # connection may be shared by the threads of a pipeline.
+        self.db = sqlite3.connect(os.path.join(cachedir, 'scores.db'), timeout=60, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.db.executescript(_SCHEMA)
+
+    def get(self, package: str, version: str, pyright: str) -> PackageScores|None:
+        """ Get the cached scores for a package, or None if we don't have them.
+            stubs will be None if the package was scored without looking for stubs.
+        """
+        with self.lock:
+            key = (package, version, pyright)
+            row = self.db.execute('SELECT stubs, description FROM packages '
+                                  'WHERE package=? AND version=? AND pyright=?', key).fetchone()
+            if row is None:
+                return None
+            result = PackageScores(package, version=version, stubs=row[0], description=row[1], cached=True)
+            for module, typed, score, metadata in self.db.execute(
+                    'SELECT module, typed, score, metadata FROM modules '
+                    'WHERE package=? AND version=? AND pyright=? ORDER BY rowid', key):
+                report = TypeCompleteness.from_dict(json.loads(metadata)) if metadata else None
+                result.modules.append(ModuleScore(module, bool(typed), score, report))
+            return result
+
+    def put(self, package: str, result: PackageScores, pyright: str) -> None:
+        """ Save the scores for a package. """
+        with self.lock:
+            key = (package, result.version, pyright)
+            with self.db:
+                self.db.execute('DELETE FROM modules WHERE package=? AND version=? AND pyright=?', key)
+                self.db.execute('INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?, ?)',
+                                key + (result.stubs, result.description, time.time()))
+                self.db.executemany('INSERT INTO modules VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    [key + (m.module, int(m.typed), m.score,
+                                            json.dumps(asdict(m.report)) if m.report else None)
+                                     for m in result.modules])
+
+    def set_stubs(self, package: str, version: str, pyright: str, stubs: str) -> None:
+        """ Fill in the stubs for a package that was cached without them. """
+        with self.lock, self.db:
+            self.db.execute('UPDATE packages SET stubs=? WHERE package=? AND version=? AND pyright=?',
+                            (stubs, package, version, pyright))
+
+    def put_resolution(self, package: str, version: str) -> None:
+        """ Record the version pip said it would install for a package. """
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?)', (package, version, time.time()))
+
+    def resolution(self, package: str, ttl: float) -> str|None:
+        """ Get the version pip last said it would install for a package, if that
+            was less than ttl seconds ago, or None.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT version FROM resolutions WHERE package=? AND resolved_at>?',
+                                  (package, time.time() - ttl)).fetchone()
+            return row[0] if row else None
+
+    def put_duration(self, package: str, seconds: float) -> None:
+        """ Record how long it last took to score a package, for scheduling later runs. """
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO durations VALUES (?, ?, ?)', (package, seconds, time.time()))
+
+    def durations(self) -> dict[str, float]:
+        """ Get how long it last took to score each package we have scored. """
+        with self.lock:
+            return dict(self.db.execute('SELECT package, seconds FROM durations'))
+
+    def put_memory(self, package: str, peak_mb: float) -> None:
+        """ Record the peak memory pyright last needed for a package, for scheduling later runs. """
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO memory VALUES (?, ?, ?)', (package, peak_mb, time.time()))
+
+    def memory(self) -> dict[str, float]:
+        """ Get the peak memory, in megabytes, that pyright last needed for each package we have scored. """
+        with self.lock:
+            return dict(self.db.execute('SELECT package, peak_mb FROM memory'))
+
+    def close(self) -> None:
+        self.db.close()
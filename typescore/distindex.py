@@ -0,0 +1,59 @@
+import os
+
+
+def _read_metadata(metadata_file: str) -> tuple[str|None, str]:
+    """ Get the Name: and Version: entries from a METADATA file. """
+    name = None
+    version = ''
+    with open(metadata_file) as f:
+        for line in f:
+            if line.startswith('Name:'):
+                name = line[5:].strip()
+            elif line.startswith('Version:'):
+                version = line[8:].strip()
+            elif not line.strip():
+                break  # The headers are over; the rest is the description.
+    return name, version
+
+
+class DistributionIndex:
+    """ The distributions installed in a site-packages folder, kept up to date
+        by looking only at the dist-info folders that have come or gone since
+        it was last refreshed, rather than reading every METADATA file again.
+    """
+
+    def __init__(self, site_packages: str):
+        self.site_packages = site_packages
+        self.entries: dict[str, tuple[str, str]] = {}  # dist-info folder -> (name, version)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """ Bring the index up to date with what is installed now. """
+        try:
+            found = {name for name in os.listdir(self.site_packages) if name.endswith('.dist-info')}
+        except FileNotFoundError:
+            found = set()
+        for gone in self.entries.keys() - found:
+            del self.entries[gone]
+        for new in found - self.entries.keys():
+            try:
+                name, version = _read_metadata(os.path.join(self.site_packages, new, 'METADATA'))
+            except OSError:
+                continue
+            if name:
+                self.entries[new] = (name, version)
+
+    def names(self) -> set[str]:
+        """ Get the names of the installed distributions, as given in their metadata. """
+        self.refresh()
+        return {name for name, _ in self.entries.values()}
+
+    def versions(self) -> dict[str, str]:
+        """ Get the installed distributions' names mapped to their versions. """
+        self.refresh()
+        return dict(self.entries.values())
+
+    def paths(self) -> dict[str, str]:
+        """ Get the installed distributions' names mapped to their dist-info folders. """
+        self.refresh()
+        return {name: os.path.join(self.site_packages, folder) for folder, (name, _) in self.entries.items()}
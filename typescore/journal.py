@@ -0,0 +1,55 @@
+import json
+import os
+import threading
+from dataclasses import asdict
+from .results import PackageScores
+
+
+def read_journal(path: str) -> dict[str, PackageScores|None]:
+    """ Read the packages recorded in a journal, mapping each to its scores, or
+        to None if it failed to install. A partly written last line (from a run
+        that was killed while writing it) is ignored.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            result = entry['result']
+            done[entry['package']] = PackageScores.from_dict(result) if result else None
+    return done
+
+
+class Journal:
+    """ An append-only record of each package a run has finished with, so that
+        a run that dies can be resumed without redoing them. Every entry is
+        flushed to disk before record returns. Packages can be recorded from
+        any thread, in the order they finish rather than the order of the run.
+    """
+
+    def __init__(self, path: str, resume: bool=False):
+        """ Start a new journal at path, or add to the existing one if resume is true. """
+        self.f = open(path, 'a' if resume else 'w')
+        self.lock = threading.Lock()
+        if resume and self.f.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # Don't run on from a partly written last line.
+                    self.f.write('\n')
+
+    def record(self, package: str, result: PackageScores|None) -> None:
+        """ Record that we have finished with package. result is None if it failed to install. """
+        entry = {'package': package, 'result': asdict(result) if result else None}
+        with self.lock:
+            self.f.write(json.dumps(entry))
+            self.f.write('\n')
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def close(self) -> None:
+        self.f.close()
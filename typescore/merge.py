@@ -0,0 +1,59 @@
+import os
+import sys
+from .report import group_rows, read_rows
+from .results import ModuleScore, PackageScores
+from .sinks import join_extra, open_sink
+from .typescore import normalize_name, parse_line, read_packages
+
+
+def _to_result(rows: list[dict], sep: str) -> PackageScores:
+    first = rows[0]
+    return PackageScores(first['package'], join_extra(list(first['extra']), sep), first.get('version') or '',
+                         first.get('stubs') or '', first.get('description') or '',
+                         [ModuleScore(row['module'], row['typed'], row['score']) for row in rows])
+
+
+def merge_scores(shardfiles: list[str], packagesfile: str|None, scorefile: str|list[str]|None=None,
+                 verbose: bool=True, sep: str=',') -> list[str]:
+    """ Combine the score files written by sharded runs (see compute_scores)
+        into one, with the packages in the order of the packagesfile that was
+        sharded (or else in the order of the shard files). Shard files may be
+        in any of the formats the sinks write. If a package is in more than
+        one shard file, the first one wins. Shard files that don't exist are
+        skipped, so a partial result can still be merged. Packages that are in
+        the shard files but not the package list go at the end. Returns the
+        packages there are no results for.
+    """
+    results: dict[str, PackageScores] = {}
+    for shardfile in shardfiles:
+        if not os.path.exists(shardfile):
+            print(f'Shard file {shardfile} not found; skipping it', file=sys.stderr)
+            continue
+        for package, rows in group_rows(read_rows(shardfile, sep)).items():
+            name = normalize_name(package)
+            if name in results:
+                print(f'{package} is in more than one shard; using the first', file=sys.stderr)
+                continue
+            results[name] = _to_result(rows, sep)
+
+    order = [parse_line(line, sep)[0] for line in read_packages(None, packagesfile)]
+    listed = {normalize_name(package) for package in order}
+    order.extend(result.package for name, result in results.items() if name not in listed)
+
+    scorefiles = [scorefile] if isinstance(scorefile, str) else scorefile or [None]
+    sinks = [open_sink(path, verbose, sep) for path in scorefiles]
+    missing = []
+    try:
+        for package in order:
+            result = results.pop(normalize_name(package), None)
+            if result:
+                for sink in sinks:
+                    sink.write(result)
+            else:
+                missing.append(package)
+    finally:
+        for sink in sinks:
+            sink.close()
+    if missing:
+        print(f'No results for {len(missing)} packages: {", ".join(missing)}', file=sys.stderr)
+    return missing
@@ -0,0 +1,84 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterator
+
+
+_DONE = object()
+
+
+async def _run(jobs: list, prepare: Callable, finish: Callable, depth: int, out: queue.Queue,
+               stop: threading.Event, discard: Callable|None) -> None:
+    loop = asyncio.get_running_loop()
+    prepared: asyncio.Queue = asyncio.Queue(maxsize=depth)
+    unfinished: list[Future] = []  # Preparations that haven't been handed to finish
+    with ThreadPoolExecutor(max_workers=depth, thread_name_prefix='typescore-prepare') as preparers, \
+         ThreadPoolExecutor(max_workers=1, thread_name_prefix='typescore-finish') as finisher:
+
+        async def produce():
+            for job in jobs:
+                if stop.is_set():
+                    break
+                future = preparers.submit(prepare, job)
+                unfinished.append(future)
+                # This waits while depth packages are already prepared or being prepared.
+                await prepared.put(future)
+            await prepared.put(None)
+
+        async def consume():
+            while (future := await prepared.get()) is not None:
+                item = await asyncio.wrap_future(future)
+                if stop.is_set():
+                    break
+                unfinished.remove(future)
+                out.put(await loop.run_in_executor(finisher, finish, item))
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            await consume()
+        finally:
+            producer.cancel()
+            # Clean up after the packages that were prepared but won't be finished.
+            for future in unfinished:
+                if not future.cancel():
+                    try:
+                        item = await asyncio.wrap_future(future)
+                    except Exception:
+                        continue
+                    if discard:
+                        discard(item)
+
+
+def pipelined(jobs: list, prepare: Callable[[Any], Any], finish: Callable[[Any], Any],
+              depth: int=2, discard: Callable[[Any], None]|None=None) -> Iterator:
+    """ Run prepare and then finish on each of jobs, yielding the results of
+        finish in the order of jobs. The jobs are run as a pipeline: up to
+        depth of them are prepared (concurrently) ahead of the one being
+        finished, but only one is finished at a time. So prepare should do the
+        work that can overlap with other packages, like fetching and network
+        lookups, and finish the work that has the scoring environment to itself.
+        If the results aren't all used, discard is called on each job that was
+        prepared but not finished, and the pipeline has stopped by the time the
+        generator is closed.
+    """
+    out: queue.Queue = queue.Queue()
+    stop = threading.Event()
+
+    def run():
+        try:
+            asyncio.run(_run(jobs, prepare, finish, depth, out, stop, discard))
+        except BaseException as e:
+            out.put(e)
+        out.put(_DONE)
+
+    thread = threading.Thread(target=run, name='typescore-pipeline', daemon=True)
+    thread.start()
+    try:
+        while (result := out.get()) is not _DONE:
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+    finally:
+        stop.set()
+        thread.join()
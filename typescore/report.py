@@ -0,0 +1,153 @@
+import csv
+import hashlib
+import html
+import json
+import os
+import re
+import sqlite3
+from .sinks import COLUMNS
+
+
+# Each package's section of a report is wrapped in these markers, so that the
+# next render can tell which sections it can keep as they are.
+SECTION = re.compile(r'<!-- typescore:section (\S+) ([0-9a-f]+) -->\n.*?<!-- typescore:end -->\n', re.DOTALL)
+
+MARKDOWN_HEAD = '# Typing completeness scores\n\n'
+MARKDOWN_TAIL = ''
+HTML_HEAD = ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>Typing completeness scores</title>\n'
+             '</head>\n<body>\n<h1>Typing completeness scores</h1>\n')
+HTML_TAIL = '</body>\n</html>\n'
+
+
+def _csv_rows(path: str, sep: str) -> list[dict]:
+    with open(path, newline='') as f:
+        reader = csv.reader(f, delimiter=sep)
+        header = next(reader, [])
+        rows = []
+        for fields in reader:
+            row = dict(zip(header, fields))
+            row['typed'] = row.get('typed') == 'True'
+            row['extra'] = fields[len(header):]
+            rows.append(row)
+    return rows
+
+
+def read_rows(path: str, sep: str=',') -> list[dict]:
+    """ Read the rows of results from a score file written by compute_scores,
+        in any of the formats it can write (see sinks.open_sink).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.jsonl':
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if ext in ('.db', '.sqlite'):
+        db = sqlite3.connect(path)
+        try:
+            query = f'SELECT {", ".join(COLUMNS)} FROM scores ORDER BY rowid'
+            rows = [dict(zip(COLUMNS, r)) for r in db.execute(query)]
+        finally:
+            db.close()
+        for row in rows:
+            row['typed'] = bool(row['typed'])
+            row['extra'] = json.loads(row['extra'])
+        return rows
+    if ext == '.parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Reading scores from Parquet needs pyarrow (pip install pyarrow)') from None
+        return pq.read_table(path).to_pylist()
+    return _csv_rows(path, sep)
+
+
+def group_rows(rows: list[dict]) -> dict[str, list[dict]]:
+    """ Group rows by package, keeping the order the packages first appear in. """
+    groups: dict[str, list[dict]] = {}
+    for row in rows:
+        groups.setdefault(row['package'], []).append(row)
+    return groups
+
+
+def _digest(rows: list[dict], extra_names: list[str]) -> str:
+    data = json.dumps([rows, extra_names], sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+def _md(text) -> str:
+    return str(text).replace('|', '\\|').replace('\n', ' ')
+
+
+def render_section(package: str, rows: list[dict], extra_names: list[str], fmt: str) -> str:
+    """ Render the section of the report for one package, as 'markdown' or 'html'. """
+    first = rows[0]
+    title = f'{package} {first.get("version") or ""}'.strip()
+    names = extra_names + [f'extra{i + 1}' for i in range(len(extra_names), len(first['extra']))]
+    header = ['top-level module', 'typed', 'score'] + names[:len(first['extra'])]
+    table = [[row['module'], row['typed'], row['score']] + list(row['extra']) for row in rows]
+    notes = []
+    if first.get('description'):
+        notes.append(first['description'])
+    if first.get('stubs'):
+        notes.append(f'Stubs: {first["stubs"]}')
+
+    lines = [f'<!-- typescore:section {package} {_digest(rows, extra_names)} -->']
+    if fmt == 'html':
+        lines.append(f'<section id="{html.escape(package)}">')
+        lines.append(f'<h2>{html.escape(title)}</h2>')
+        lines.extend(f'<p>{html.escape(str(note))}</p>' for note in notes)
+        lines.append('<table>')
+        lines.append('<tr>' + ''.join(f'<th>{html.escape(h)}</th>' for h in header) + '</tr>')
+        for cells in table:
+            lines.append('<tr>' + ''.join(f'<td>{html.escape(str(c))}</td>' for c in cells) + '</tr>')
+        lines.append('</table>')
+        lines.append('</section>')
+    else:
+        lines.append(f'## {_md(title)}')
+        lines.append('')
+        for note in notes:
+            lines.append(_md(note))
+            lines.append('')
+        lines.append('|' + '|'.join(header) + '|')
+        lines.append('|' + '---|' * len(header))
+        for cells in table:
+            lines.append('|' + '|'.join(_md(c) for c in cells) + '|')
+        lines.append('')
+    lines.append('<!-- typescore:end -->')
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(scorefile: str, reportfile: str, sep: str=',', extra_names: list[str]|None=None) -> tuple[int, int]:
+    """ Render the results in scorefile as a report with a section for each
+        package, in reportfile. The format is HTML if reportfile ends in .html
+        or .htm, and markdown otherwise. If reportfile already exists, only the
+        sections of packages whose results have changed are rendered again;
+        the rest are kept as they are, and the file isn't written at all if
+        nothing changed. Returns the number of sections rendered and the total.
+    """
+    fmt = 'html' if reportfile.lower().endswith(('.html', '.htm')) else 'markdown'
+    extra_names = extra_names or []
+    old = {}
+    if os.path.exists(reportfile):
+        with open(reportfile) as f:
+            old_text = f.read()
+        old = {m.group(1): (m.group(2), m.group(0)) for m in SECTION.finditer(old_text)}
+    else:
+        old_text = None
+
+    sections = []
+    rendered = 0
+    groups = group_rows(read_rows(scorefile, sep))
+    for package, rows in groups.items():
+        digest = _digest(rows, extra_names)
+        if package in old and old[package][0] == digest:
+            sections.append(old[package][1])
+        else:
+            sections.append(render_section(package, rows, extra_names, fmt))
+            rendered += 1
+
+    head, tail = (HTML_HEAD, HTML_TAIL) if fmt == 'html' else (MARKDOWN_HEAD, MARKDOWN_TAIL)
+    text = head + ''.join(sections) + tail
+    if text != old_text:
+        with open(reportfile, 'w') as f:
+            f.write(text)
+    return rendered, len(groups)
@@ -0,0 +1,110 @@
+from dataclasses import dataclass, field
+
+
+@dataclass
+class SymbolCounts:
+    """ How many symbols pyright found with known, ambiguous and unknown types. """
+    known: int = 0
+    ambiguous: int = 0
+    unknown: int = 0
+
+
+@dataclass
+class Diagnostic:
+    """ A diagnostic from pyright that isn't attached to a particular symbol. """
+    severity: str
+    message: str
+    file: str = ''
+
+
+@dataclass
+class TypeCompleteness:
+    """ The parts of a pyright --verifytypes report that we keep for a module.
+        If pyright failed to score the module, error says why. If it was
+        stopped for going over a time or memory limit, status is 'timeout' or
+        'oom', and if it couldn't be run or gave no report, status is 'failed';
+        a status is shown instead of the score.
+    """
+    module: str
+    score: float = 0.0
+    exported: SymbolCounts = field(default_factory=SymbolCounts)
+    other: SymbolCounts = field(default_factory=SymbolCounts)
+    missing_function_docstrings: int = 0
+    missing_class_docstrings: int = 0
+    missing_default_params: int = 0
+    files_analyzed: int = 0
+    pyright_version: str = ''
+    diagnostics: list[Diagnostic] = field(default_factory=list)
+    error: str|None = None
+    seconds: float = 0.0  # Wall-clock time the analysis took
+    peak_mb: float = 0.0  # Peak resident memory of pyright, in megabytes
+    status: str = ''
+
+    @property
+    def percent(self) -> str:
+        """ The score formatted the way pyright prints it, e.g. '19.2%'. """
+        if self.status:
+            return self.status
+        if self.error:
+            return '0%'
+        # pyright rounds half up to one decimal place and drops a trailing '.0'.
+        return f'{int(self.score * 1000 + 0.5) / 10:g}%'
+
+    @staticmethod
+    def from_dict(d: dict) -> 'TypeCompleteness':
+        """ Rebuild a TypeCompleteness from its dataclasses.asdict form. """
+        d = dict(d)
+        d['exported'] = SymbolCounts(**d['exported'])
+        d['other'] = SymbolCounts(**d['other'])
+        d['diagnostics'] = [Diagnostic(**x) for x in d['diagnostics']]
+        return TypeCompleteness(**d)
+
+
+@dataclass
+class ModuleScore:
+    """ The score for one top-level module of a package. """
+    module: str
+    typed: bool
+    score: str
+    report: TypeCompleteness|None = None
+
+
+@dataclass
+class PackageScores:
+    """ Everything we found out about a package while scoring it.
+        extra holds the pass-through columns from the packages file,
+        including the leading separator. If the package couldn't be
+        scored at all, error says why.
+    """
+    package: str
+    extra: str = ''
+    version: str = ''
+    stubs: str|None = ''  # None if we haven't looked for stub packages yet
+    description: str = ''
+    modules: list[ModuleScore] = field(default_factory=list)
+    timings: dict[str, float] = field(default_factory=dict)  # Seconds spent in each phase
+    error: str|None = None
+    cached: bool = False  # True if the scores came from the cache
+
+    @property
+    def typed(self) -> bool:
+        """ True if all of the package's top-level modules have a py.typed file. """
+        return bool(self.modules) and all(m.typed for m in self.modules)
+
+    @property
+    def peak_mb(self) -> float:
+        """ The peak memory pyright used to analyze the package, in megabytes.
+            The modules of a package are analyzed at the same time (up to the
+            analyzer's max_procs), so this is the total of theirs, which is an
+            upper bound when there are more modules than that.
+        """
+        return sum(m.report.peak_mb for m in self.modules if m.report)
+
+    @staticmethod
+    def from_dict(d: dict) -> 'PackageScores':
+        """ Rebuild a PackageScores from its dataclasses.asdict form. """
+        d = dict(d)
+        d['modules'] = [ModuleScore(m['module'], m['typed'], m['score'],
+                                    TypeCompleteness.from_dict(m['report']) if m['report'] else None)
+                        for m in d['modules']]
+        return PackageScores(**d)
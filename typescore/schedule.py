@@ -0,0 +1,149 @@
+import os
+import statistics
+from typing import TYPE_CHECKING, Callable
+from .wheelhouse import find_wheel
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+
+def estimate_durations(packages: list[str], history: dict[str, float],
+                       wheelhouse: str|None=None) -> list[float]:
+    """ Estimate how many seconds scoring each package will take. Packages
+        we have scored before (in history) are expected to take as long as
+        they did last time. For the others we go by the size of their wheel,
+        at the median seconds per byte of the packages we know about, or else
+        assume the median duration.
+    """
+    sizes = {}
+    if wheelhouse:
+        for package in packages:
+            wheel = find_wheel(package, wheelhouse)
+            if wheel:
+                sizes[package] = os.path.getsize(wheel)
+    known = [history[p] for p in packages if p in history]
+    default = statistics.median(known) if known else 1.0
+    rates = [history[p] / sizes[p] for p in sizes if p in history and sizes[p]]
+    rate = statistics.median(rates) if rates else None
+    estimates = []
+    for package in packages:
+        if package in history:
+            estimates.append(history[package])
+        elif package in sizes and rate is not None:
+            estimates.append(sizes[package] * rate)
+        elif package in sizes and not known:
+            estimates.append(sizes[package] / 1e6)  # Nothing to calibrate with; a second per megabyte.
+        else:
+            estimates.append(default)
+    return estimates
+
+
+# How many megabytes pyright is assumed to need for a package, when we have
+# nothing to go by.
+DEFAULT_MEMORY_MB = 500.0
+
+
+def estimate_memory(packages: list[str], history: dict[str, float]) -> list[float]:
+    """ Estimate how many megabytes pyright will need to analyze each package.
+        Packages we have scored before (in history) are expected to need as
+        much as they did last time; the others the median of those we know
+        about, or DEFAULT_MEMORY_MB.
+    """
+    known = [history[p] for p in packages if p in history]
+    default = statistics.median(known) if known else DEFAULT_MEMORY_MB
+    return [history.get(package, default) for package in packages]
+
+
+def longest_first(units: list[list[int]], estimates: list[float]) -> list[list[int]]:
+    """ Order units of work (lists of indexes into estimates) so that the ones
+        expected to take longest start first. Units expected to take the same
+        time keep their order.
+    """
+    return sorted(units, key=lambda unit: -sum(estimates[i] for i in unit))
+
+
+def plan_batches(closures: list[dict[str, str]|None], size: int) -> list[list[int]]:
+    """ Group packages to be installed together, given the dependency closure
+        of each (normalized name -> version, including the package itself), or
+        None if it couldn't be resolved. A package joins the group it shares
+        the most dependencies with, as long as the group has room and none of
+        the shared dependencies need different versions; otherwise it starts
+        a new group. Returns the groups as lists of indexes into closures.
+    """
+    groups: list[list[int]] = []
+    merged: list[dict[str, str]] = []  # The combined closure of each group
+    for i, closure in enumerate(closures):
+        best = None
+        best_overlap = 0
+        if closure:
+            for g, combined in enumerate(merged):
+                if len(groups[g]) >= size:
+                    continue
+                shared = closure.keys() & combined.keys()
+                if any(closure[name] != combined[name] for name in shared):
+                    continue
+                if len(shared) > best_overlap:
+                    best, best_overlap = g, len(shared)
+        if best is None:
+            groups.append([i])
+            merged.append(dict(closure or {}))
+        else:
+            groups[best].append(i)
+            merged[best].update(closure)
+    return groups
+
+
+class MemoryAdmission:
+    """ Starts units of work (lists of indexes into the packages) while the
+        memory they are expected to need, added up, stays within budget
+        megabytes, and no more than slots of them at a time. The units are
+        tried in the order given, and one that doesn't fit is passed over for
+        a later, smaller one that does, so that many small packages can run
+        alongside a big one. A unit that needs more than the whole budget is
+        started once nothing else is running.
+    """
+
+    def __init__(self, units: list[list[int]], memory: list[float], budget: float, slots: int,
+                 submit: Callable[[list[int]], 'Future']):
+        """ memory - the megabytes each package is expected to need (see estimate_memory)
+            submit - starts a unit of work, and returns its future
+        """
+        self.waiting = list(units)
+        # The packages of a unit are scored one after another.
+        self.need = {tuple(unit): max((memory[i] for i in unit), default=0.0) for unit in units}
+        self.budget = budget
+        self.slots = slots
+        self.submit = submit
+        self.running: dict['Future', tuple] = {}
+        self.futures: dict[tuple, 'Future'] = {}
+
+    def _admit(self) -> None:
+        for future in [f for f in self.running if f.done()]:
+            del self.running[future]
+        in_use = sum(self.need[unit] for unit in self.running.values())
+        for unit in list(self.waiting):
+            if len(self.running) >= self.slots:
+                break
+            key = tuple(unit)
+            if self.running and in_use + self.need[key] > self.budget:
+                continue
+            future = self.submit(unit)
+            self.futures[key] = future
+            self.running[future] = key
+            in_use += self.need[key]
+            self.waiting.remove(unit)
+
+    def result(self, unit: list[int]):
+        """ Get the result of a unit of work, starting others while we wait for it. """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        key = tuple(unit)
+        self._admit()
+        while key not in self.futures:
+            wait(list(self.running), return_when=FIRST_COMPLETED)
+            self._admit()
+        future = self.futures.pop(key)
+        while not future.done():
+            # Keep the workers busy while we wait.
+            wait(list(self.running), return_when=FIRST_COMPLETED)
+            self._admit()
+        return future.result()
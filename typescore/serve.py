@@ -0,0 +1,191 @@
+import json
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from packaging.version import InvalidVersion, Version
+from .analyzer import pyright_version
+from .cache import ResultCache
+from .results import PackageScores
+from .typescore import (get_skiplist, make_analyzer, normalize_name, prepare_package, resolve_version,
+                        score_prepared)
+
+
+# A valid project name, as PEP 508 defines it. Anything else (such as a pip
+# option) is refused rather than passed to pip.
+_NAME = re.compile(r'^([A-Z0-9]|[A-Z0-9][A-Z0-9._-]*[A-Z0-9])$', re.IGNORECASE)
+
+# How many seconds the version pip picks for a package is trusted for, unless
+# told otherwise. Long enough that repeated requests don't each run pip.
+DEFAULT_RESOLVE_TTL = 300.0
+
+
+class ScoreService:
+    """ Scores packages on request. The scoring is done one package at a time
+        by a background thread, as every package is installed into the same
+        environment; requests wait for it in a queue. A request for a package
+        version that is already queued or being scored waits for that result
+        rather than scoring it again, and scores are kept in memory (and in the
+        cache in cachedir, if given) so that asking again is answered at once.
+        Which version pip would pick for a package is remembered for
+        resolve_ttl seconds, so that requests that don't name a version don't
+        have to ask pip each time, and requests that come in while pip is being
+        asked about a package wait for its answer.
+    """
+
+    def __init__(self, cachedir: str|None=None, stubs: bool=False, resolve_ttl: float=DEFAULT_RESOLVE_TTL):
+        self.stubs = stubs
+        self.resolve_ttl = resolve_ttl
+        self.skiplist = get_skiplist()
+        self.analyzer = make_analyzer()
+        self.pyright = self.analyzer.version or pyright_version()
+        self.cache = ResultCache(cachedir) if cachedir else None
+        self.lock = threading.Lock()
+        self.results: dict[tuple[str, str], PackageScores] = {}
+        self.resolved: dict[str, tuple[str|None, float]] = {}  # package -> (version, when)
+        self.resolving: dict[str, Future] = {}  # package -> the version pip is being asked for
+        self.pending: dict[tuple[str, str], Future] = {}
+        self.queue: queue.Queue = queue.Queue()
+        threading.Thread(target=self._work, name='typescore-serve', daemon=True).start()
+
+    def _resolve(self, package: str) -> str|None:
+        name = normalize_name(package)
+        with self.lock:
+            version, when = self.resolved.get(name, (None, 0.0))
+            if version and time.monotonic() - when < self.resolve_ttl:
+                return version
+            future = self.resolving.get(name)
+            asking = future is None
+            if asking:
+                future = Future()
+                self.resolving[name] = future
+        if not asking:
+            return future.result()
+        version = None
+        try:
+            version = resolve_version(package, self.skiplist)
+        finally:
+            with self.lock:
+                self.resolved[name] = (version, time.monotonic())
+                del self.resolving[name]
+            future.set_result(version)
+        return version
+
+    def score(self, package: str, version: str|None=None) -> PackageScores:
+        """ Get the scores for a package, scoring it if need be. If version is
+            None, it is the version pip would install now. Raises a ValueError
+            if package isn't a valid package name or version isn't a valid version.
+        """
+        if not _NAME.match(package):
+            raise ValueError(f'Invalid package name: {package}')
+        if version is not None:
+            try:
+                Version(version)
+            except InvalidVersion:
+                raise ValueError(f'Invalid version: {version}')
+        if version is None:
+            version = self._resolve(package)
+        key = (normalize_name(package), version or '')
+        with self.lock:
+            result = self.results.get(key)
+            if result:
+                return result
+            future = self.pending.get(key)
+            if future is None:
+                future = Future()
+                self.pending[key] = future
+                self.queue.put((package, version, key, future))
+        return future.result()
+
+    def queued(self) -> int:
+        """ Get how many packages are waiting to be scored or being scored. """
+        with self.lock:
+            return len(self.pending)
+
+    def _work(self) -> None:
+        while True:
+            package, version, key, future = self.queue.get()
+            try:
+                prepared = prepare_package(package, '', self.stubs, self.skiplist, self.pyright, self.cache,
+                                           version=version)
+                result = score_prepared(prepared, self.skiplist, self.analyzer, self.cache)
+            except Exception as e:
+                result = PackageScores(package, error=str(e))
+            if not result.error and not result.modules:
+                result.error = f'No modules found to score for {package}'
+            with self.lock:
+                # Keep failures out, so that asking again tries again.
+                if not result.error:
+                    self.results[key] = result
+                    if result.version:
+                        self.results[(key[0], result.version)] = result
+                del self.pending[key]
+            future.set_result(result)
+
+
+def _as_json(result: PackageScores) -> dict:
+    data = asdict(result)
+    del data['extra']
+    data['typed'] = result.typed
+    data['peak_mb'] = result.peak_mb
+    return data
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service: ScoreService
+    verbose: bool = False
+
+    def _send(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.split('/') if p]
+        if parts == ['health']:
+            self._send(200, {'status': 'ok', 'queued': self.service.queued()})
+        elif len(parts) in (2, 3) and parts[0] == 'score':
+            version = parts[2] if len(parts) == 3 else parse_qs(url.query).get('version', [None])[0]
+            try:
+                result = self.service.score(parts[1], version)
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+                return
+            self._send(404 if result.error else 200, _as_json(result))
+        else:
+            self._send(404, {'error': f'No such endpoint: {url.path}'})
+
+    def log_message(self, format: str, *args) -> None:
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(host: str, port: int, cachedir: str|None=None, verbose: bool=False,
+          resolve_ttl: float=DEFAULT_RESOLVE_TTL) -> None:
+    """ Run a scoring service on host and port until interrupted. GET
+        /score/<package> or /score/<package>/<version> gets a package's scores
+        as JSON (with a status of 404 if it couldn't be scored, and the reason
+        in error, or 400 if the package name or version isn't valid), and GET /health says how many packages are queued. Set up
+        how packages are installed and analyzed with configure first. If
+        verbose is true, stub packages are looked for and requests are logged.
+        Versions pip resolved packages to are trusted for resolve_ttl seconds.
+    """
+    service = ScoreService(cachedir, verbose, resolve_ttl)
+    handler = type('Handler', (_Handler,), {'service': service, 'verbose': verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f'Serving scores on http://{host}:{server.server_port}/', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+from typing import TextIO
+from .results import PackageScores
+
+
+# The columns of a row of results; there is one row per scored module.
+COLUMNS = ['package', 'version', 'typed', 'module', 'score', 'stubs', 'description', 'extra']
+
+
+def split_extra(extra: str, sep: str) -> list[str]:
+    """ Split the extra columns from the packages file (with their leading separator) into fields. """
+    if not extra:
+        return []
+    return next(csv.reader([extra[len(sep):]], delimiter=sep))
+
+
+def join_extra(fields: list[str], sep: str) -> str:
+    """ Join fields into extra columns, with their leading separator (the reverse of split_extra). """
+    if not fields:
+        return ''
+    out = io.StringIO()
+    csv.writer(out, delimiter=sep, lineterminator='').writerow(fields)
+    return sep + out.getvalue()
+
+
+def rows(result: PackageScores, sep: str) -> list[dict]:
+    """ Get the rows of results for a package, one per module. """
+    extra = split_extra(result.extra, sep)
+    return [{'package': result.package, 'version': result.version, 'typed': m.typed, 'module': m.module,
+             'score': m.score, 'stubs': result.stubs, 'description': result.description, 'extra': extra}
+            for m in result.modules]
+
+
+class Sink:
+    """ Somewhere the results of a run are written to as each package is scored. """
+
+    def write(self, result: PackageScores) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class CsvSink(Sink):
+    """ Writes results as CSV, to a file or standard output. If verbose is false,
+        the version, stubs and description columns are left out.
+    """
+
+    def __init__(self, path: str|None, verbose: bool, sep: str=','):
+        self.f: TextIO = open(path, 'w', newline='') if path else sys.stdout
+        self.verbose = verbose
+        self.sep = sep
+        self.writer = csv.writer(self.f, delimiter=sep, lineterminator='\n')
+        if verbose:
+            self.writer.writerow(['package', 'version', 'typed', 'module', 'score', 'stubs', 'description'])
+        else:
+            self.writer.writerow(['package', 'typed', 'module', 'score'])
+
+    def write(self, result: PackageScores) -> None:
+        for row in rows(result, self.sep):
+            if self.verbose:
+                self.writer.writerow([row['package'], row['version'], row['typed'], row['module'], row['score'],
+                                      row['stubs'], row['description']] + row['extra'])
+            else:
+                self.writer.writerow([row['package'], row['typed'], row['module'], row['score']] + row['extra'])
+        self.f.flush()
+
+    def close(self) -> None:
+        if self.f is not sys.stdout:
+            self.f.close()
+
+
+class JsonlSink(Sink):
+    """ Writes each row of results as a line of JSON. """
+
+    def __init__(self, path: str, sep: str=','):
+        self.f = open(path, 'w')
+        self.sep = sep
+
+    def write(self, result: PackageScores) -> None:
+        for row in rows(result, self.sep):
+            self.f.write(json.dumps(row))
+            self.f.write('\n')
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class SqliteSink(Sink):
+    """ Writes results to a scores table in a SQLite database, committing them
+        in batches of batch rows. The extra columns are stored as a JSON list.
+    """
+
+    def __init__(self, path: str, sep: str=',', batch: int=500):
+        self.db = sqlite3.connect(path)
+        self.sep = sep
+        self.batch = batch
+        self.pending: list[tuple] = []
+        with self.db:
+            self.db.execute('DROP TABLE IF EXISTS scores')
+            self.db.execute('CREATE TABLE scores (package TEXT, version TEXT, typed INTEGER, module TEXT, '
+                            'score TEXT, stubs TEXT, description TEXT, extra TEXT)')
+
+    def write(self, result: PackageScores) -> None:
+        for row in rows(result, self.sep):
+            row['extra'] = json.dumps(row['extra'])
+            self.pending.append(tuple(row[c] for c in COLUMNS))
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.db:
+            self.db.executemany(f'INSERT INTO scores VALUES ({", ".join("?" * len(COLUMNS))})', self.pending)
+        self.pending = []
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
+
+
+class ParquetSink(Sink):
+    """ Writes results to a Parquet file, a row group of up to batch rows at a
+        time. Needs pyarrow.
+    """
+
+    def __init__(self, path: str, sep: str=',', batch: int=10000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Writing scores to Parquet needs pyarrow (pip install pyarrow)') from None
+        self.pa = pa
+        self.schema = pa.schema([('package', pa.string()), ('version', pa.string()), ('typed', pa.bool_()),
+                                 ('module', pa.string()), ('score', pa.string()), ('stubs', pa.string()),
+                                 ('description', pa.string()), ('extra', pa.list_(pa.string()))])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.sep = sep
+        self.batch = batch
+        self.pending: list[dict] = []
+
+    def write(self, result: PackageScores) -> None:
+        self.pending.extend(rows(result, self.sep))
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.writer.write_table(self.pa.Table.from_pylist(self.pending, schema=self.schema))
+            self.pending = []
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+
+
+def open_sink(path: str|None, verbose: bool, sep: str=',') -> Sink:
+    """ Open a sink for path, with the format going by its extension: .jsonl,
+        .db or .sqlite, .parquet, or else CSV. If path is None, CSV is written
+        to standard output.
+    """
+    ext = os.path.splitext(path)[1].lower() if path else ''
+    if ext == '.jsonl':
+        return JsonlSink(path, sep)
+    if ext in ('.db', '.sqlite'):
+        return SqliteSink(path, sep)
+    if ext == '.parquet':
+        return ParquetSink(path, sep)
+    return CsvSink(path, verbose, sep)
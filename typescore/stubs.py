@@ -0,0 +1,153 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from packaging.utils import (InvalidSdistFilename, InvalidWheelFilename, canonicalize_name,
+                             parse_sdist_filename, parse_wheel_filename)
+from packaging.version import InvalidVersion, Version
+
+
+PYPI_JSON_API = 'https://pypi.org/pypi'
+TYPESHED_STUBS = 'https://github.com/python/typeshed/tree/main/stubs'
+
+
+def typeshed_index(typeshed: str) -> set[str]:
+    """ Get the (normalized) names of the packages that have stubs in the
+        stubs folder of a local typeshed checkout.
+    """
+    stubs = os.path.join(typeshed, 'stubs')
+    return {canonicalize_name(d) for d in os.listdir(stubs) if os.path.isdir(os.path.join(stubs, d))}
+
+
+def _versions_from_html(page: str) -> list[str]:
+    """ Get the versions of the files listed on a PEP 503 simple API page. """
+    versions = []
+    for filename in re.findall(r'>([^<]+)</a>', page):
+        try:
+            if filename.endswith('.whl'):
+                versions.append(str(parse_wheel_filename(filename)[1]))
+            else:
+                versions.append(str(parse_sdist_filename(filename)[1]))
+        except (InvalidWheelFilename, InvalidSdistFilename):
+            pass
+    return versions
+
+
+def _newest(versions: list[str]) -> str:
+    parsed = []
+    for v in versions:
+        try:
+            parsed.append((Version(v), v))
+        except InvalidVersion:
+            pass
+    return max(parsed)[1] if parsed else ''
+
+
+class StubFinder:
+    """ Looks for stub packages for packages, in typeshed and on PyPI (or a
+        mirror of it). The candidates for a package are all looked up at once
+        over a pool of kept-alive connections, and the answers are cached for
+        ttl seconds; in cachedir if given, so that later runs can use them too.
+    """
+
+    def __init__(self, typeshed: str|None=None, index: str=PYPI_JSON_API, cachedir: str|None=None,
+                 ttl: float=24*60*60):
+        """ typeshed - a local typeshed checkout to use instead of asking GitHub
+            index - the base URL of a PyPI JSON API (.../pypi) or simple API (.../simple)
+        """
+        self.typeshed = typeshed_index(typeshed) if typeshed else None
+        self.index = index.rstrip('/')
+        self.simple = self.index.endswith('/simple')
+        self.ttl = ttl
+        # Made on first use (see _start).
+        self.session = None
+        self.executor = None
+        self.memo: dict[str, tuple[str|None, float]] = {}
+        self.db = None
+        self.lock = threading.Lock()
+        if cachedir:
+            os.makedirs(cachedir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(cachedir, 'stubs.db'), timeout=60,
+                                      check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS stubs '
+                            '(package TEXT PRIMARY KEY, stubs TEXT, fetched_at REAL NOT NULL)')
+
+    def _start(self) -> None:
+        with self.lock:
+            if self.session is None:
+                import requests
+                from concurrent.futures import ThreadPoolExecutor
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.executor = ThreadPoolExecutor(max_workers=8)
+                self.session = session
+
+    def _in_typeshed(self, package: str) -> bool:
+        if self.typeshed is not None:
+            return canonicalize_name(package) in self.typeshed
+        r = self.session.get(f'{TYPESHED_STUBS}/{package}', timeout=30)
+        return r.status_code == 200
+
+    def _on_index(self, stub_package: str) -> str|None:
+        """ Get the name and newest version of stub_package if the index has it. """
+        if self.simple:
+            r = self.session.get(f'{self.index}/{canonicalize_name(stub_package)}/', timeout=30,
+                                 headers={'Accept': 'application/vnd.pypi.simple.v1+json'})
+            if r.status_code != 200:
+                return None
+            if 'json' in r.headers.get('Content-Type', ''):
+                versions = r.json().get('versions', [])
+            else:
+                versions = _versions_from_html(r.text)
+            return f'{stub_package} {_newest(versions)}'.strip()
+        r = self.session.get(f'{self.index}/{stub_package}/json', timeout=30)
+        if r.status_code != 200:
+            return None
+        info = r.json()['info']
+        return f'{info["name"]} {info["version"]}'
+
+    def _lookup(self, package: str) -> str|None:
+        self._start()
+        typeshed = self.executor.submit(self._in_typeshed, package)
+        candidates = [self.executor.submit(self._on_index, stub_package)
+                      for stub_package in [package + '-stubs', 'types-' + package]]
+        if typeshed.result():
+            return 'typeshed'
+        for candidate in candidates:
+            found = candidate.result()
+            if found:
+                return found
+        return None
+
+    def find(self, package: str) -> str|None:
+        """ See if typeshed or PyPI has a package that looks like it is likely type
+            stubs for package, and if so, return that (with its version), or
+            'typeshed'. Raises an exception if we can't find out.
+        """
+        key = canonicalize_name(package)
+        now = time.time()
+        if key in self.memo and now - self.memo[key][1] < self.ttl:
+            return self.memo[key][0]
+        if self.db:
+            with self.lock:
+                row = self.db.execute('SELECT stubs, fetched_at FROM stubs WHERE package=?', (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                self.memo[key] = (row[0], row[1])
+                return row[0]
+        stubs = self._lookup(package)
+        self.memo[key] = (stubs, now)
+        if self.db:
+            with self.lock, self.db:
+                self.db.execute('INSERT OR REPLACE INTO stubs VALUES (?, ?, ?)', (key, stubs, now))
+        return stubs
+
+    def close(self) -> None:
+        if self.session:
+            self.executor.shutdown()
+            self.session.close()
+        if self.db:
+            self.db.close()
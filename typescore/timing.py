@@ -0,0 +1,96 @@
+import json
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from .results import PackageScores
+
+
+# The phases of scoring a package, in the order they happen.
+PHASES = ['resolve', 'cache', 'fetch', 'install', 'metadata', 'stubs', 'analyze', 'cleanup']
+
+
+@contextmanager
+def timed(timings: dict[str, float], phase: str) -> Iterator[None]:
+    """ Add the wall-clock time taken by the body of a with statement to timings[phase]. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+
+def percentile(values: list[float], p: float) -> float:
+    """ Get the p'th percentile of values (nearest rank). """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, int(p / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+class RunProfile:
+    """ Collects the timings of the packages scored in a run, and summarizes them.
+        Packages answered from the cache are counted separately, so that they
+        don't inflate the scoring rate. timings holds the time spent on the
+        run as a whole rather than on any one package, such as planning batches.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.packages: list[PackageScores] = []
+        self.timings: dict[str, float] = {}
+
+    def add(self, result: PackageScores) -> None:
+        self.packages.append(result)
+
+    def _phases(self) -> list[str]:
+        seen = {phase for result in self.packages for phase in result.timings}
+        return [phase for phase in PHASES if phase in seen] + sorted(seen - set(PHASES))
+
+    def _times(self, phase: str) -> list[float]:
+        return [r.timings[phase] for r in self.packages if phase in r.timings]
+
+    def summary(self, slowest: int=10) -> str:
+        """ Get a summary of where the time went: totals and percentiles for each
+            phase, and the slowest packages.
+        """
+        elapsed = time.perf_counter() - self.start
+        hits = sum(r.cached for r in self.packages)
+        n = len(self.packages) - hits
+        rate = n * 3600 / elapsed if elapsed else 0.0
+        lines = [f'Scored {n} packages in {elapsed:.1f}s ({rate:.0f} packages/hour)'
+                 + (f', and found {hits} in the cache' if hits else ''),
+                 f'{"phase":<10} {"total":>10} {"p50":>8} {"p95":>8}']
+        for phase in self._phases():
+            values = self._times(phase)
+            lines.append(f'{phase:<10} {sum(values):>9.1f}s {percentile(values, 50):>7.2f}s '
+                         f'{percentile(values, 95):>7.2f}s')
+        for phase, total in self.timings.items():
+            lines.append(f'{phase:<10} {total:>9.1f}s  (for the whole run)')
+        totals = sorted(((sum(r.timings.values()), r.package) for r in self.packages), reverse=True)
+        if totals:
+            lines.append('Slowest packages:')
+            for total, package in totals[:slowest]:
+                lines.append(f'  {package:<30} {total:>8.1f}s')
+        return '\n'.join(lines)
+
+    def write(self, path: str) -> None:
+        """ Write the timings for each package and module, and the totals for
+            each phase, to path as JSON.
+        """
+        phases = {}
+        for phase in self._phases():
+            values = self._times(phase)
+            phases[phase] = {'total': sum(values), 'p50': percentile(values, 50), 'p95': percentile(values, 95)}
+        profile = {
+            'elapsed': time.perf_counter() - self.start,
+            'cache_hits': sum(r.cached for r in self.packages),
+            'phases': phases,
+            'run': self.timings,
+            'packages': [{'package': r.package, 'version': r.version, 'cached': r.cached,
+                          'timings': r.timings, 'peak_mb': r.peak_mb,
+                          'modules': {m.module: m.report.seconds for m in r.modules if m.report}}
+                         for r in self.packages],
+        }
+        with open(path, 'w') as f:
+            json.dump(profile, f, indent=2)
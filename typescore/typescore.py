@@ -1,10 +1,60 @@
+import csv
 import glob
+import hashlib
+import json
 import os
 import subprocess
 import re
+import shutil
 import sys
-from importlib.metadata import version, metadata
-import requests
+import tempfile
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Iterator
+from .analyzer import Analyzer, pyright_version
+from .cache import ResultCache
+from .distindex import DistributionIndex
+from .journal import Journal, read_journal
+from .results import ModuleScore, PackageScores, TypeCompleteness
+from .schedule import MemoryAdmission, estimate_durations, estimate_memory, longest_first, plan_batches
+from .sinks import open_sink
+from .stubs import PYPI_JSON_API, StubFinder
+from .timing import RunProfile, timed
+from .wheelhouse import build_wheels, find_wheel, pip_options, unpack_package, wheel_version
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from importlib.metadata import Distribution
+
+
+# The environment that packages get installed into and scored in. By default
+# this is the one typescore is running in, but each --jobs worker process
+# switches to its own virtualenv (see use_environment).
+_python = sys.executable
+_site_packages: str|None = None
+_dist_index: DistributionIndex|None = None
+
+# The top-level modules found for each (package, version) (see get_modules).
+_module_memo: dict[tuple[str, str], list[tuple[str, bool]]] = {}
+
+# Extra options for pip when installing, such as where to install from.
+_pip_options: list[str] = []
+_wheelhouse: str|None = None
+
+# Whether to unpack wheels into a temporary folder instead of installing
+# packages (see use_unpack), and if so whether to unpack dependencies too.
+_unpack = False
+_unpack_deps = False
+
+# Where we look for stub packages (see use_stub_finder).
+_stub_finder: StubFinder|None = None
+
+# Limits on the time and memory pyright can use for a module (see use_limits).
+_timeout: float|None = None
+_memory_limit: int|None = None
+
+# How many seconds the versions pip resolved packages to are trusted for
+# (see cached_version).
+_resolve_ttl: float = 0.0
 
 
 def normalize_name(package: str) -> str:
@@ -13,24 +63,131 @@ def normalize_name(package: str) -> str:
     return re.sub(r"[-_.]+", "_", package).lower()
 
 
-def install(package: str, skiplist: list[str]) -> None:
-    """ Run a pip install and wait for completion. Raise a CalledProcessError on failure. """
+def install(package: str, skiplist: list[str], wheels: str|None=None, version: str|None=None) -> None:
+    """ Run a pip install and wait for completion. Raise a CalledProcessError on failure.
+        If wheels is given, install only from the wheels in that folder. If version
+        is given, install that version.
+    """
     if package not in skiplist:
-        subprocess.run([sys.executable, "-m", "pip", "install", package, "--require-virtualenv"], capture_output=True, check=True)
+        options = pip_options(wheels) if wheels else _pip_options
+        spec = f'{package}=={version}' if version else package
+        subprocess.run([_python, "-m", "pip", "install", spec, "--require-virtualenv"] + options,
+                       capture_output=True, check=True)
+
+
+def resolve_version(package: str, skiplist: list[str]) -> str|None:
+    """ Get the version of a package that install would give us, without installing it.
+        Returns None if we can't tell.
+    """
+    try:
+        if package in skiplist:
+            return get_distribution(package).version
+        s = subprocess.run([_python, "-m", "pip", "install", package, "--dry-run", "--no-deps",
+                            "--ignore-installed", "--quiet", "--report", "-"] + _pip_options,
+                           capture_output=True, text=True, check=True)
+        return json.loads(s.stdout)['install'][0]['metadata']['version']
+    except Exception:
+        return None
+
+
+def use_resolve_ttl(ttl: float) -> None:
+    """ Trust the versions pip resolved packages to, as recorded in the cache,
+        for ttl seconds (see cached_version). 0 means always ask pip.
+    """
+    global _resolve_ttl
+    _resolve_ttl = ttl
+
+
+def cached_version(package: str, skiplist: list[str], cache: ResultCache) -> str|None:
+    """ Get the version of a package that install would give us, as recorded in
+        the cache if pip resolved it within the resolve TTL (see use_resolve_ttl),
+        or else from resolve_version, recording the answer.
+    """
+    name = normalize_name(package)
+    if _resolve_ttl > 0:
+        ver = cache.resolution(name, _resolve_ttl)
+        if ver:
+            return ver
+    ver = resolve_version(package, skiplist)
+    if ver:
+        cache.put_resolution(name, ver)
+    return ver
+
+
+def resolve_closure(package: str) -> dict[str, str]|None:
+    """ Get the packages (normalized names mapped to versions) that installing
+        package would give us, including itself, without installing anything.
+        Returns None if we can't tell.
+    """
+    try:
+        s = subprocess.run([_python, "-m", "pip", "install", package, "--dry-run", "--ignore-installed",
+                            "--quiet", "--report", "-"] + _pip_options,
+                           capture_output=True, text=True, check=True)
+        return {normalize_name(item['metadata']['name']): item['metadata']['version']
+                for item in json.loads(s.stdout)['install']}
+    except Exception:
+        return None
 
 
 def get_site_packages() -> str:
     """ Get the install location for packages. """
+    if _site_packages:
+        return _site_packages
     paths = [p for p in sys.path if p.find('site-packages')>0]
     assert(len(paths) == 1)
     site_packages = paths[0]
     return site_packages
 
 
-def get_toplevels(package: str) -> list[str]:
-    """ Get the top-level modules associated with a package. """
+def use_environment(python: str) -> None:
+    """ Install and score packages in the (virtual) environment of the given
+        Python interpreter rather than the one we are running in.
+    """
+    global _python, _site_packages
+    s = subprocess.run([python, "-c", "import sysconfig; print(sysconfig.get_paths()['purelib'])"],
+                       capture_output=True, text=True, check=True)
+    _python = python
+    _site_packages = s.stdout.strip()
+
+
+def use_wheelhouse(wheelhouse: str|None) -> None:
+    """ Install packages only from the wheels in wheelhouse, without using the
+        package index (see wheelhouse.fetch_wheels), or from the package index
+        again if wheelhouse is None.
+    """
+    global _pip_options, _wheelhouse
+    _pip_options = pip_options(wheelhouse) if wheelhouse else []
+    _wheelhouse = wheelhouse
+
+
+def use_unpack(unpack: bool=True, deps: bool=False) -> None:
+    """ Score packages by unpacking their wheels into a temporary folder rather
+        than installing them (or go back to installing them, if unpack is false),
+        optionally along with the wheels of their dependencies. The wheels come
+        from the wheelhouse if there is one, or else are downloaded (or built)
+        for each package.
+    """
+    global _unpack, _unpack_deps
+    _unpack = unpack
+    _unpack_deps = unpack and deps
+
+
+def get_distribution(package: str, site_packages: str|None=None) -> 'Distribution':
+    """ Get the installed distribution for a package from the scoring environment,
+        or from site_packages if given.
+    """
+    from importlib.metadata import distributions
+    for dist in distributions(name=package, path=[site_packages or get_site_packages()]):
+        return dist
+    raise ModuleNotFoundError(f'No distribution found for {package}')
+
+
+def get_toplevels(package: str, site_packages: str|None=None) -> list[str]:
+    """ Get the top-level modules associated with a package installed in the
+        scoring environment, or in site_packages if given.
+    """
     # See if there is a toplevel.txt file for the package
-    site_packages = get_site_packages()
+    site_packages = site_packages or get_site_packages()
     norm = normalize_name(package)
     loc = f'{site_packages}/{norm}-*.dist-info'
     files = glob.glob(loc)
@@ -51,59 +208,44 @@ def get_toplevels(package: str) -> list[str]:
     return [norm]
                     
 
-def get_score(package: str, subpath: str) -> str:
+def get_scores(package: str, subpaths: list[str], analyzer: Analyzer|None=None,
+               site_packages: str|None=None) -> dict[str, TypeCompleteness]:
+    """ Use pyright to get type coverage reports for several top-level modules
+        of a package. Returns a dictionary mapping subpath to report.
+        package - package name part of the folder under site-packages where dist-info is found
+        subpaths - module paths under site-packages
+        analyzer - the Analyzer for this run; if None, a new one is started
+        site_packages - a folder the package was unpacked into, if it isn't
+            installed in the scoring environment
+    """
+    if analyzer is None:
+        analyzer = make_analyzer()
+    if site_packages:
+        return analyzer.analyze(package, site_packages, subpaths, search_path=site_packages)
+    return analyzer.analyze(package, get_site_packages(), subpaths)
+
+
+def get_score(package: str, subpath: str, analyzer: Analyzer|None=None) -> str:
     """ Use pyright to get type coverage score for a top-level module and its children
-        in a package folder. pyright requires a py.typed file so we create one if needed.
+        in a package folder.
         package - package name part of the folder under site-packages where dist-info is found
         subpath - module path under site-packages (which may be the same as package, but need not be)
     """
-    tf = f'{get_site_packages()}/{subpath}/py.typed'
-    if not os.path.exists(tf):
-        # Crteate a dummy py.typed for now that we will clean up afterwards
-        with open(tf, 'w') as f:
-            pass
-    else:
-        tf = None  # Prevents py.typed from being removed.
-    try:
-        module = subpath.replace('/', '.')
-        s = subprocess.run([sys.executable, "-m", "pyright", "--verifytypes", module], capture_output=True, text=True)
-        for line in s.stdout.split('\n'):
-            l = line.strip()
-            if l.startswith('error: Module'):
-                print(f'{package}/{module}: Scoring failed: {l}', file=sys.stderr)
-                return '0%'
-            elif l.startswith('Type completeness score'):
-                return l[l.rfind(' ')+1:]
-    except Exception as e:
-        print(f'{package}/{module}: Scoring failed: {e}', file=sys.stderr)
-    finally:
-        # Clean up py.typed if needed
-        if tf:
-            os.remove(tf)
-    print(f'{package}/{module}: Scoring failed: No score line found', file=sys.stderr)
-    return '0%'
+    return get_scores(package, [subpath], analyzer)[subpath].percent
 
  
-def get_name_from_metadata(metadata_file: str) -> str|None:
-    """ Get the Name: entry from a METADATA file for a package. """
-    with open(metadata_file) as f:
-        for line in f:
-             if line.startswith('Name:'):
-                 return line[5:].strip()
-    return None
+def get_distribution_index() -> DistributionIndex:
+    """ Get the index of the distributions installed in the scoring environment. """
+    global _dist_index
+    site_packages = get_site_packages()
+    if _dist_index is None or _dist_index.site_packages != site_packages:
+        _dist_index = DistributionIndex(site_packages)
+    return _dist_index
 
 
 def get_installed(skip: list[str]) -> list[str]:
     """ Get the list of installed packages except if they are in skip. """
-    site_packages = get_site_packages()
-    loc = f'{site_packages}/*.dist-info/METADATA'
-    files = glob.glob(loc)
-    pkgs = []
-    for file in files:
-        pkg = get_name_from_metadata(file)
-        if pkg and pkg not in skip:
-            pkgs.append(pkg)
-    return pkgs
+    return sorted(get_distribution_index().names() - set(skip))
 
 
 def get_skiplist() -> list[str]:
@@ -145,28 +287,11 @@ def cleanup(skiplist: list[str]) -> None:
     """ Remove all installed packages not in skiplist. """
     pkgs = get_installed(skiplist)
     if pkgs:
-        cmd = [sys.executable, "-m", "pip", "uninstall", "-y"]
+        cmd = [_python, "-m", "pip", "uninstall", "-y"]
         cmd.extend(pkgs)
         subprocess.run(cmd, capture_output=True, check=True)
 
 
-def single_file_to_folder(site_packages: str, subpath: str) -> None:
-    """ Convert a module that is a single file to a folder form. 
-        We need this in order to also create a temporary py.typed file.
-    """
-    os.mkdir(f'{site_packages}/{subpath}')
-    os.rename(f'{site_packages}/{subpath}.py', f'{site_packages}/{subpath}/__init__.py')
-
-
-def folder_to_single_file(site_packages: str, subpath: str) -> None:
-    """ Convert a folder module that is a single file to a top-level one. 
-        Used to undo the changes from the function above.
-    """
-    os.rename(f'{site_packages}/{subpath}/__init__.py',
-              f'{site_packages}/{subpath.replace("-", "_")}.py')
-    os.rmdir(f'{site_packages}/{subpath}')
- 
-
 def namespace_module_resolve(site_packages: str, package: str, toplevel: str) -> str|None:
     """ A real kludge to handle (some) namespace modules,
         because I don't want to write an import resolver 
@@ -180,43 +305,608 @@ def namespace_module_resolve(site_packages: str, package: str, toplevel: str) ->
     return None
 
 
+def _record_modules(files: list[str]) -> tuple[list[tuple[str, bool]], list[str]]:
+    """ Work out the importable top-level modules from the files a distribution's
+        RECORD lists. Returns the modules we can score, as (subpath, typed) pairs,
+        and the native modules that have no Python code to score. A folder with
+        no __init__ file is a namespace package, so the modules inside it are
+        the ones that count (like google/protobuf).
+    """
+    packages = {}  # folder -> files in it (relative paths)
+    modules = {}  # single-file module subpath -> whether it is Python
+    for path in files:
+        parts = path.split('/')
+        if parts[0] in ('', '..') or parts[0].endswith(('.dist-info', '.data')) or '__pycache__' in parts:
+            continue
+        *folders, name = parts
+        stem, ext = os.path.splitext(name)
+        stem = stem.split('.')[0]  # mod.cpython-311-x86_64-linux-gnu.so -> mod
+        for i in range(len(folders)):
+            packages.setdefault('/'.join(folders[:i + 1]), set())
+        if folders:
+            packages['/'.join(folders)].add(name)
+        if ext in ('.py', '.pyi', '.so', '.pyd'):
+            subpath = '/'.join(folders + [stem])
+            modules[subpath] = modules.get(subpath, False) or ext in ('.py', '.pyi')
+
+    def is_package(folder: str) -> bool:
+        return bool({'__init__.py', '__init__.pyi'} & packages[folder])
+
+    found = []
+    native = []
+    for subpath in sorted(set(packages) | set(modules)):
+        parts = subpath.split('/')
+        if not all(part.isidentifier() for part in parts):
+            continue  # Can't be imported, like the numpy.libs folders auditwheel adds.
+        if any(is_package('/'.join(parts[:i])) for i in range(1, len(parts))):
+            continue  # Part of a package we already have.
+        if subpath in packages:
+            if is_package(subpath):
+                found.append((subpath, 'py.typed' in packages[subpath]))
+        elif modules[subpath]:
+            found.append((subpath, False))
+        else:
+            native.append(subpath)
+    return found, native
+
+
+def get_modules(package: str, site_packages: str|None=None) -> list[tuple[str, bool]]:
+    """ Get the top-level modules of a package installed in the scoring environment,
+        or in site_packages if given, as (subpath, typed) pairs, where typed is
+        whether the module has a py.typed file. The modules come from the RECORD
+        in the package's dist-info, and are remembered for each package version.
+        If there is no RECORD we go by top_level.txt (or the package name).
+    """
+    site_packages = site_packages or get_site_packages()
+    norm = normalize_name(package)
+    dist_infos = [d for d in os.listdir(site_packages)
+                  if d.endswith('.dist-info') and normalize_name(d[:-10].split('-')[0]) == norm]
+    if len(dist_infos) == 1:
+        version = dist_infos[0][:-10].split('-', 1)[-1]
+        if (norm, version) in _module_memo:
+            return _module_memo[(norm, version)]
+        record = f'{site_packages}/{dist_infos[0]}/RECORD'
+        if os.path.exists(record):
+            with open(record, newline='') as f:
+                found, native = _record_modules([row[0] for row in csv.reader(f) if row])
+            for subpath in native:
+                print(f'Package {package} module {subpath.replace("/", ".")} is native code; not scoring it',
+                      file=sys.stderr)
+            _module_memo[(norm, version)] = found
+            return found
+
+    paths = get_toplevels(package, site_packages)
+    if len(paths) == 1:
+        nm_path = namespace_module_resolve(site_packages, package, paths[0])
+        if nm_path:
+            paths = [nm_path]
+    found = []
+    for subpath in paths:
+        if os.path.isdir(f'{site_packages}/{subpath}'):
+            found.append((subpath, os.path.exists(f'{site_packages}/{subpath}/py.typed')))
+        elif os.path.exists(f'{site_packages}/{subpath.replace("-", "_")}.py'):
+            # A single-file module can't have a py.typed file.
+            found.append((subpath, False))
+        else:
+            print(f'Package {package} module {subpath.replace("/", ".")} not found in site packages',
+                  file=sys.stderr)
+    return found
+
+
+def use_stub_finder(typeshed: str|None=None, index: str=PYPI_JSON_API, cachedir: str|None=None) -> None:
+    """ Set up how get_stub_package looks for stubs: in a local typeshed checkout
+        rather than on GitHub, and/or in a PyPI mirror. If cachedir is given,
+        answers are cached there for later runs as well as this one.
+    """
+    global _stub_finder
+    if _stub_finder:
+        _stub_finder.close()
+    _stub_finder = StubFinder(typeshed, index, cachedir)
+
+
 def get_stub_package(package: str) -> str | None:
     """ See if typeshed or PyPI has a package that looks like it is likely type
         stubs for package, and if so, return that. """
+    if _stub_finder is None:
+        use_stub_finder()
+    return _stub_finder.find(package)
 
-    uri = f'https://github.com/python/typeshed/tree/master/stubs/{package}'
-    r = requests.get(uri, stream=True)
-    if r.status_code == 200:
-        return 'typeshed'
-
-    for stub_package in [package + '-stubs', 'types-' + package]:
-        uri = f'https://pypi.org/project/{stub_package}/'
-        r = requests.get(uri, stream=True)
-        if r.status_code == 200:
-            # Kludge to get version
-            page = r.text
-            start = page.find('<h1 class="package-header__name">')
-            if start > 0:
-                start += 33
-                end = page.find('<', start)
-                return page[start:end].strip()
-            return stub_package
-    return None
 
+def use_limits(timeout: float|None=None, memory_limit: int|None=None) -> None:
+    """ Limit how many seconds, and how many megabytes of heap, pyright can use
+        to analyze a module (see Analyzer).
+    """
+    global _timeout, _memory_limit
+    _timeout = timeout
+    _memory_limit = memory_limit
 
-def compute_scores(packages: list[str]|None, packagesfile: str|None, scorefile: str|None=None,
-                   verbose: bool=True, sep: str=',') -> None:
-    """ Read a list of packages (and extra columns) from a packagesfile,
-        or get them passed in as packages (and then append those in the file),
-        and compute the type coverage scores, writing the results as a CSV
-        file to scorefile, using column separator sep.
-        If scorefile is None, print results to standard output instead
-        (currently this can conmingle with error messages as those are
-        going to stdout too).
-        
-        If verbose is true, include package version and description in the output.
+
+def make_analyzer(max_procs: int|None=None) -> Analyzer:
+    """ Start an Analyzer for the scoring environment, with the limits set by
+        use_limits, running up to max_procs pyright processes at once (by
+        default, one per CPU).
+    """
+    return Analyzer(_python, _timeout, _memory_limit, max_procs)
+
+
+def configure(wheelhouse: str|None=None, unpack: bool=False, unpack_deps: bool=False,
+              typeshed: str|None=None, stubs_index: str|None=None, cachedir: str|None=None,
+              timeout: float|None=None, memory_limit: int|None=None, resolve_ttl: float=0.0) -> None:
+    """ Set up how packages are installed, looked up and analyzed. See
+        compute_scores for what the arguments mean. Every setting is replaced,
+        so anything not given goes back to its default.
+    """
+    use_wheelhouse(wheelhouse)
+    use_unpack(unpack, unpack_deps)
+    use_stub_finder(typeshed, stubs_index or PYPI_JSON_API, cachedir)
+    use_limits(timeout, memory_limit)
+    use_resolve_ttl(resolve_ttl)
+
+
+def in_shard(package: str, shard: tuple[int, int]) -> bool:
+    """ Tell whether package belongs to shard (k, n), the k'th of n (counting
+        from 1). This goes by a hash of the normalized package name, so every
+        machine splits a package list the same way.
+    """
+    k, n = shard
+    digest = hashlib.sha1(normalize_name(package).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % n == k - 1
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """ Parse a shard given as 'K/N'. Raises a ValueError if it isn't valid. """
+    k, n = (int(x) for x in shard.split('/'))
+    if not 1 <= k <= n:
+        raise ValueError(f'Shard {shard} is not in the range 1/{n} to {n}/{n}')
+    return k, n
+
+
+def parse_line(line: str, sep: str) -> tuple[str, str]:
+    """ Split a line from the packages file into the package name and the
+        extra columns (which keep their leading separator).
+    """
+    parts = [p.strip() for p in line.split(sep, 1)]
+    package = parts[0]
+    extra = f'{sep}{parts[1]}' if len(parts) == 2 else ''
+    return package, extra
+
+
+@dataclass
+class PreparedPackage:
+    """ A package that prepare_package has got ready to be installed and scored
+        by finish_package: its version found and cache checked, and its wheels
+        fetched (or unpacked) and stubs looked up if that was asked for.
+    """
+    package: str
+    extra: str
+    verbose: bool
+    timings: dict[str, float] = field(default_factory=dict)
+    result: PackageScores|None = None  # The cached result, if there is one
+    error: str|None = None  # Why we couldn't get the package, if we couldn't
+    wheels: str|None = None  # A temporary folder of wheels to install from
+    target: str|None = None  # The temporary folder the package was unpacked into
+    stubs: str|None = None  # The stub package, if it has been looked up yet
+    version: str|None = None  # The version to score, if one was asked for
+
+
+def prepare_package(package: str, extra: str, verbose: bool, skiplist: list[str], pyright: str,
+                    cache: ResultCache|None=None, fetch: bool=False,
+                    version: str|None=None) -> PreparedPackage:
+    """ Do the parts of scoring a package that don't need the scoring environment:
+        find out which version we would get and whether that is in the cache,
+        and unpack it if we are unpacking rather than installing. If fetch is
+        true, also download its wheels (and those of its dependencies) ahead of
+        installing it, and look for stubs if verbose is true, so that these can
+        be done while another package is being analyzed. If version is given,
+        that version of the package is scored rather than the one pip would pick.
+    """
+    prepared = PreparedPackage(package, extra, verbose, version=version)
+    spec = f'{package}=={version}' if version else package
+    timings = prepared.timings
+    wheels = None
+
+    try:
+
+        # Find the package version, getting wheels if we are going to unpack them
+
+        ver = None
+        with timed(timings, 'resolve'):
+            if _unpack:
+                wheels = _wheelhouse
+                if not wheels:
+                    wheels = tempfile.mkdtemp(prefix='typescore-')
+                    try:
+                        build_wheels(spec, wheels, _unpack_deps, _python, _pip_options)
+                    except Exception as e:
+                        prepared.error = f'Failed to get wheels for {package}: {e}'
+                        print(prepared.error, file=sys.stderr)
+                        return prepared
+                wheel = find_wheel(package, wheels)
+                ver = wheel_version(wheel) if wheel else None
+                if version and ver != version:
+                    prepared.error = f'No wheel for {spec}'
+                    print(prepared.error, file=sys.stderr)
+                    return prepared
+            elif version:
+                ver = version
+            elif cache:
+                ver = cached_version(package, skiplist, cache)
+
+        # Check the cache
+
+        if cache and ver:
+            with timed(timings, 'cache'):
+                result = cache.get(normalize_name(package), ver, pyright)
+            if result:
+                result.package = package
+                result.extra = extra
+                result.timings = timings
+                if result.stubs is None:
+                    result.stubs = ''
+                    if verbose:
+                        try:
+                            with timed(timings, 'stubs'):
+                                result.stubs = str(get_stub_package(package))
+                            cache.set_stubs(normalize_name(package), result.version, pyright, result.stubs)
+                        except Exception as e:
+                            pass
+                prepared.result = result
+                return prepared
+
+        # Unpack the package, or get its wheels ready to install
+
+        if _unpack:
+            try:
+                with timed(timings, 'install'):
+                    prepared.target = tempfile.mkdtemp(prefix='typescore-')
+                    unpack_package(package, wheels, prepared.target, _unpack_deps)
+            except Exception as e:
+                prepared.error = f'Failed to install {package}: {e}'
+                print(prepared.error, file=sys.stderr)
+                shutil.rmtree(prepared.target, ignore_errors=True)
+                prepared.target = None
+                return prepared
+        elif fetch and not _wheelhouse and package not in skiplist:
+            with timed(timings, 'fetch'):
+                prepared.wheels = tempfile.mkdtemp(prefix='typescore-')
+                try:
+                    subprocess.run([_python, "-m", "pip", "download", spec, "--dest", prepared.wheels]
+                                   + _pip_options, capture_output=True, check=True)
+                except Exception:
+                    # Leave it to the install to get them.
+                    shutil.rmtree(prepared.wheels, ignore_errors=True)
+                    prepared.wheels = None
+
+        if fetch and verbose:
+            try:
+                with timed(timings, 'stubs'):
+                    prepared.stubs = str(get_stub_package(package))
+            except Exception as e:
+                prepared.stubs = ''
+
+    finally:
+        if wheels and wheels != _wheelhouse:
+            shutil.rmtree(wheels, ignore_errors=True)
+
+    return prepared
+
+
+def finish_package(prepared: PreparedPackage, skiplist: list[str], analyzer: Analyzer,
+                   cache: ResultCache|None=None) -> PackageScores|None:
+    """ Install a package that prepare_package got ready (unless it was unpacked),
+        score each of its top-level modules, and then clean up. Returns None if
+        the package could not be installed, or the cached result if there was one.
+    """
+    if prepared.error:
+        return None
+    if prepared.result:
+        return prepared.result
+    package, timings = prepared.package, prepared.timings
+
+    try:
+        if not _unpack:
+            try:
+                with timed(timings, 'install'):
+                    try:
+                        install(package, skiplist, prepared.wheels, prepared.version)
+                    except subprocess.CalledProcessError:
+                        if not prepared.wheels:
+                            raise
+                        install(package, skiplist, version=prepared.version)  # Something was missing from the wheels we fetched
+            except Exception as e:
+                prepared.error = f'Failed to install {package}: {e}'
+                print(prepared.error, file=sys.stderr)
+                return None
+
+        result = _score_installed(package, prepared.extra, prepared.verbose, analyzer, prepared.target,
+                                  timings, prepared.stubs)
+
+    finally:
+        with timed(timings, 'cleanup'):
+            if prepared.target:
+                shutil.rmtree(prepared.target, ignore_errors=True)
+            elif not _unpack:
+                try:
+                    cleanup(skiplist)
+                except Exception as e:
+                    print(e, file=sys.stderr)
+            if prepared.wheels:
+                shutil.rmtree(prepared.wheels, ignore_errors=True)
+
+    _cache_result(cache, result, analyzer.version or pyright_version())
+    return result
+
+
+def discard_prepared(prepared: PreparedPackage) -> None:
+    """ Remove the temporary folders of a package that prepare_package got
+        ready, for when it won't be finished after all.
+    """
+    for folder in (prepared.target, prepared.wheels):
+        if folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def score_prepared(prepared: PreparedPackage, skiplist: list[str], analyzer: Analyzer,
+                   cache: ResultCache|None=None) -> PackageScores:
+    """ Like finish_package, but a package that couldn't be scored gets a result
+        that says why in its error, rather than None.
+    """
+    result = finish_package(prepared, skiplist, analyzer, cache)
+    if result is None:
+        result = PackageScores(prepared.package, prepared.extra, timings=prepared.timings,
+                               error=prepared.error or f'Failed to score {prepared.package}')
+    return result
+
+
+def score_package(package: str, extra: str, skiplist: list[str], verbose: bool,
+                  analyzer: Analyzer|None=None, cache: ResultCache|None=None) -> PackageScores|None:
+    """ Install a package, score each of its top-level modules, and then
+        uninstall it again. Returns None if the package could not be installed.
+        If we have a cache and it has scores for the version of the package
+        that would be installed, those are returned instead.
+    """
+    if analyzer is None:
+        analyzer = make_analyzer()
+    pyright = analyzer.version or pyright_version()
+    prepared = prepare_package(package, extra, verbose, skiplist, pyright, cache)
+    return finish_package(prepared, skiplist, analyzer, cache)
+
+
+def _cache_result(cache: ResultCache|None, result: PackageScores, pyright: str) -> None:
+    """ Save a package's scores, and how long it took to score it and how much
+        memory that needed, in the cache.
+    """
+    if not cache:
+        return
+    cpackage = normalize_name(result.package)
+    cache.put_duration(cpackage, sum(result.timings.values()))
+    if result.peak_mb:
+        cache.put_memory(cpackage, result.peak_mb)
+    # Don't cache a result that went over a limit or that pyright didn't produce;
+    # the next run may do better.
+    if result.version and not any(m.report and m.report.status for m in result.modules):
+        cache.put(cpackage, PackageScores(cpackage, '', result.version, result.stubs or None,
+                                          result.description, result.modules), pyright)
+
+
+def score_batch(jobs: list[tuple[str, str, bool]], skiplist: list[str], analyzer: Analyzer|None=None,
+                cache: ResultCache|None=None) -> list[PackageScores|None]:
+    """ Score several packages (given as (package, extra, verbose) jobs) that
+        share dependencies by installing them all at once, scoring each of
+        them, and then cleaning up once. Those that are cached are taken from
+        the cache. If pip can't install the rest together, they are scored one
+        at a time instead. The time spent installing and cleaning up is shared
+        between the packages in the batch.
+    """
+    if _unpack or len(jobs) == 1:
+        return [score_package(package, extra, skiplist, verbose, analyzer, cache)
+                for package, extra, verbose in jobs]
+    if analyzer is None:
+        analyzer = make_analyzer()
+    pyright = analyzer.version or pyright_version()
+    results: list[PackageScores|None] = [None] * len(jobs)
+    todo = []
+    for i, (package, extra, verbose) in enumerate(jobs):
+        timings: dict[str, float] = {}
+        if cache:
+            with timed(timings, 'resolve'):
+                ver = cached_version(package, skiplist, cache)
+            with timed(timings, 'cache'):
+                result = cache.get(normalize_name(package), ver, pyright) if ver else None
+            if result:
+                if result.stubs is None:
+                    # Let score_package fill in the stubs.
+                    results[i] = score_package(package, extra, skiplist, verbose, analyzer, cache)
+                else:
+                    result.package, result.extra, result.timings = package, extra, timings
+                    results[i] = result
+                continue
+        todo.append((i, timings))
+    if not todo:
+        return results
+
+    shared: dict[str, float] = {}
+    try:
+        try:
+            with timed(shared, 'install'):
+                names = [jobs[i][0] for i, _ in todo if jobs[i][0] not in skiplist]
+                if names:
+                    subprocess.run([_python, "-m", "pip", "install", "--require-virtualenv"] + names + _pip_options,
+                                   capture_output=True, check=True)
+        except Exception as e:
+            print(f'Failed to install {", ".join(names)} together; installing them one at a time',
+                  file=sys.stderr)
+            with timed(shared, 'cleanup'):
+                cleanup(skiplist)
+            for i, _ in todo:
+                package, extra, verbose = jobs[i]
+                results[i] = score_package(package, extra, skiplist, verbose, analyzer, cache)
+            return results
+
+        for i, timings in todo:
+            package, extra, verbose = jobs[i]
+            results[i] = _score_installed(package, extra, verbose, analyzer, None, timings)
+    finally:
+        with timed(shared, 'cleanup'):
+            try:
+                cleanup(skiplist)
+            except Exception as e:
+                print(e, file=sys.stderr)
+
+    for i, timings in todo:
+        if results[i]:
+            for phase, seconds in shared.items():
+                timings[phase] = timings.get(phase, 0.0) + seconds / len(todo)
+            _cache_result(cache, results[i], pyright)
+    return results
+
+
+def _score_installed(package: str, extra: str, verbose: bool, analyzer: Analyzer,
+                     target: str|None, timings: dict[str, float], stubs: str|None=None) -> PackageScores:
+    """ Score the top-level modules of a package that has been installed in the
+        scoring environment, or unpacked into target. Time spent in each phase
+        is added to timings. If the stubs have already been looked up they are
+        passed in as stubs.
+    """
+
+    # Get attributes
+
+    site_packages = target or get_site_packages()
+    result = PackageScores(package, extra, timings=timings)
+    with timed(timings, 'metadata'):
+        try:
+            dist = get_distribution(package, site_packages)
+            result.version = dist.version
+            result.description = dist.metadata['Summary'] or ''
+        except Exception as e:
+            pass
+        found = get_modules(package, site_packages)
+
+    if stubs is not None:
+        result.stubs = stubs
+    elif verbose:
+        try:
+            with timed(timings, 'stubs'):
+                result.stubs = str(get_stub_package(package))
+        except Exception as e:
+            pass
+
+    # Score the toplevel modules all in one batch
+
+    with timed(timings, 'analyze'):
+        reports = get_scores(package, [subpath for subpath, _ in found], analyzer, target)
+    for subpath, typed in found:
+        report = reports[subpath]
+        result.modules.append(ModuleScore(report.module, typed, report.percent, report))
+    return result
+
+
+# Per-process state for --jobs workers.
+_worker_skiplist: list[str] = []
+_worker_analyzer: Analyzer|None = None
+_worker_cache: ResultCache|None = None
+
+
+def _init_worker(workdir: str, settings: dict, jobs: int=1) -> None:
+    """ Create a private virtualenv for this worker process and switch to it.
+        settings are the arguments for configure. The CPUs are shared between
+        the jobs workers, so each runs no more than its share of pyright
+        processes at once.
+    """
+    global _worker_skiplist, _worker_analyzer, _worker_cache
+    configure(**settings)
+    venv = tempfile.mkdtemp(dir=workdir)
+    subprocess.run([sys.executable, "-m", "venv", venv], capture_output=True, check=True)
+    bindir = 'Scripts' if sys.platform == 'win32' else 'bin'
+    use_environment(os.path.join(venv, bindir, 'python'))
+    # typescore's own dependencies aren't in the new virtualenv, so only what
+    # is already there (pip, setuptools) needs keeping.
+    _worker_skiplist = get_installed([])
+    _worker_analyzer = make_analyzer(max(1, (os.cpu_count() or 1) // jobs))
+    if settings['cachedir']:
+        _worker_cache = ResultCache(settings['cachedir'])
+
+
+def _score_in_worker(jobs: list[tuple[str, str, bool]]) -> list[PackageScores|None]:
+    return score_batch(jobs, _worker_skiplist, _worker_analyzer, _worker_cache)
+
+
+def _score_one_in_worker(package: str, verbose: bool) -> PackageScores:
+    pyright = _worker_analyzer.version or pyright_version()
+    prepared = prepare_package(package, '', verbose, _worker_skiplist, pyright, _worker_cache)
+    return score_prepared(prepared, _worker_skiplist, _worker_analyzer, _worker_cache)
+
+
+def _journal_unit(log: Journal, packages: list[str], future: 'Future') -> None:
+    """ Record the packages of a unit of work in the journal once its future is done. """
+    if future.cancelled() or future.exception():
+        return
+    for package, result in zip(packages, future.result()):
+        log.record(package, result)
+
+
+def _in_order(count: int, units: list[list[int]], get_results) -> Iterator[PackageScores|None]:
+    """ Yield the results of count jobs in order, given the units of work they
+        were split into (lists of job indexes) and a function that gets the
+        results of a unit. Each unit's results are got once, when the first of
+        its jobs is needed, and the rest are held until their turn.
     """
-    skiplist = get_skiplist()
+    unit_of = {i: unit for unit in units for i in unit}
+    done = {}
+    for i in range(count):
+        if i not in done:
+            unit = unit_of[i]
+            done.update(zip(unit, get_results(unit)))
+        yield done.pop(i)
+
+
+def get_cached(jobs: list[tuple[str, str, bool]], cachedir: str) -> list[PackageScores]|None:
+    """ Get the results of (package, extra, verbose) jobs from the cache in
+        cachedir, going by the versions pip resolved them to within the resolve
+        TTL (see cached_version), without asking pip, looking at the scoring
+        environment or starting pyright. Returns None unless all of them can be
+        answered this way.
+    """
+    if _resolve_ttl <= 0:
+        return None
+    cache = ResultCache(cachedir)
+    try:
+        pyright = pyright_version()
+        results = []
+        for package, extra, verbose in jobs:
+            name = normalize_name(package)
+            ver = cache.resolution(name, _resolve_ttl)
+            result = cache.get(name, ver, pyright) if ver else None
+            if result is None or (verbose and result.stubs is None):
+                return None
+            result.package = package
+            result.extra = extra
+            result.stubs = result.stubs or ''
+            results.append(result)
+        return results
+    finally:
+        cache.close()
+
+
+def get_history(packages: list[str], cachedir: str|None) -> tuple[dict[str, float], dict[str, float]]:
+    """ Get how long each of packages took to score in earlier runs, and the
+        peak memory pyright needed for it, from the cache in cachedir, for
+        those that have been scored before.
+    """
+    if not cachedir:
+        return {}, {}
+    cache = ResultCache(cachedir)
+    try:
+        durations = cache.durations()
+        memory = cache.memory()
+    finally:
+        cache.close()
+    return ({p: durations[normalize_name(p)] for p in packages if normalize_name(p) in durations},
+            {p: memory[normalize_name(p)] for p in packages if normalize_name(p) in memory})
+
+
+def read_packages(packages: list[str]|None, packagesfile: str|None) -> list[str]:
+    """ Get the packages passed in as packages, followed by the lines from packagesfile. """
     pkgs = packages if packages else []
     if packagesfile:
         with open(packagesfile) as f:
@@ -225,104 +915,201 @@ def compute_scores(packages: list[str]|None, packagesfile: str|None, scorefile:
                 if not line:
                     continue
                 pkgs.append(line)
+    return pkgs
 
-    site_packages = get_site_packages()
-    of = open(scorefile, 'w') if scorefile else None
 
-    if verbose:
-        header = f'package{sep}version{sep}typed{sep}module{sep}score{sep}stubs{sep}description'
-    else:
-        header = f'package{sep}typed{sep}module{sep}score'
-    if of:
-        of.write(header)
-        of.write('\n')
-    else:
-        print(header)
+def compute_scores(packages: list[str]|None, packagesfile: str|None, scorefile: str|list[str]|None=None,
+                   verbose: bool=True, sep: str=',', jobs: int=1, cachedir: str|None=None,
+                   wheelhouse: str|None=None, unpack: bool=False, unpack_deps: bool=False,
+                   journal: str|None=None, resume: bool=False, typeshed: str|None=None,
+                   stubs_index: str|None=None, profile: str|None=None, timeout: float|None=None,
+                   memory_limit: int|None=None, shard: tuple[int, int]|None=None,
+                   batch: int=1, prefetch: int=2, memory_budget: int|None=None,
+                   resolve_ttl: float=0.0) -> None:
+    """ Read a list of packages (and extra columns) from a packagesfile,
+        or get them passed in as packages (and then append those in the file),
+        and compute the type coverage scores, writing the results as a CSV
+        file to scorefile, using column separator sep.
+        If scorefile is None, print results to standard output instead
+        (currently this can conmingle with error messages as those are
+        going to stdout too). scorefile can also be a list of files, to write
+        the results to all of them. Files ending in .jsonl, .db or .sqlite,
+        or .parquet get JSON lines, a SQLite database or Parquet instead of CSV
+        (see sinks.open_sink).
+        
+        If verbose is true, include package version and description in the output.
+
+        If jobs is more than 1, packages are scored in that many worker
+        processes, each with its own virtualenv. The packages that are
+        expected to take longest (going by how long they took last time, if
+        cachedir is given, or else by the size of their wheels) are started
+        first. The results are still written in input order. If memory_budget
+        is also given, a package is only started while the peak memory that
+        pyright is expected to need for it and the packages already running
+        (going by what they needed last time, if cachedir is given) adds up to
+        no more than that many megabytes (see schedule.MemoryAdmission).
+
+        If cachedir is given, scores are cached there, and packages whose
+        version hasn't changed since they were cached are not scored again.
+        The version pip resolves each package to is cached too; if resolve_ttl
+        is given, it is trusted for that many seconds, and if every package
+        can be answered from the cache that way, the scoring environment, pip
+        and pyright aren't touched at all. By default pip is always asked.
+
+        If wheelhouse is given, packages are installed only from the wheels
+        in that folder, without using the package index.
+
+        If unpack is true, packages are unpacked from their wheels into a
+        temporary folder and scored there, instead of being installed; if
+        unpack_deps is also true, the wheels of their dependencies are
+        unpacked there too.
+
+        If journal is given, each package is recorded in that file as soon as
+        it is finished. If resume is also true, packages already recorded there
+        by an earlier run are not scored again; their results are taken from
+        the journal instead.
+
+        If typeshed is given, it is a local checkout of typeshed, which is used
+        to see if typeshed has stubs for a package instead of asking GitHub.
+        If stubs_index is given, it is the URL of the PyPI JSON API (ending in
+        /pypi) or simple API (ending in /simple) to look for stub packages in.
+
+        A summary of where the time went is written to stderr at the end. If
+        profile is given, the time spent in each phase for each package (and
+        in analysis for each module) is written to that file as JSON.
+
+        If timeout or memory_limit is given, pyright is stopped if it takes more
+        than that many seconds, or needs more than that many megabytes of heap,
+        for a module, and the module's score is 'timeout' or 'oom'.
+
+        If shard is given as (k, n), only the packages in the k'th of n shards
+        are scored (see in_shard); the outputs of all the shards can then be
+        put back together with merge.merge_scores.
+
+        If batch is more than 1, packages that share dependencies are installed
+        together in groups of up to that many (see schedule.plan_batches), and
+        each group is cleaned up once after all of them have been scored.
+
+        When packages are scored one at a time in this process (jobs is 1 and
+        there is no batching), the run is a pipeline: up to prefetch packages
+        ahead of the one being scored have their versions resolved, wheels
+        downloaded (or unpacked) and stubs looked up, so that the network
+        waits overlap with analysis. Installing, analyzing and cleaning up
+        still happen one package at a time. A prefetch of 0 turns this off.
+    """
+    pkgs = read_packages(packages, packagesfile)
+    settings = dict(wheelhouse=wheelhouse, unpack=unpack, unpack_deps=unpack_deps,
+                    typeshed=typeshed, stubs_index=stubs_index, cachedir=cachedir,
+                    timeout=timeout, memory_limit=memory_limit, resolve_ttl=resolve_ttl)
+    configure(**settings)
+
+    scorefiles = [scorefile] if isinstance(scorefile, str) else scorefile or [None]
+    sinks = [open_sink(path, verbose, sep) for path in scorefiles]
 
     msg = "Can't include extra columns in package file if packages are also specified on command line; ignoring"
+    work = []
     for line in pkgs:
 
         # Get package and extra columns from line
 
-        parts = [p.strip() for p in line.split(sep, 1)]
-        package = parts[0]
-        extra = f'{sep}{parts[1]}' if len(parts) == 2 else ''
+        package, extra = parse_line(line, sep)
         if extra and packages:
             if msg:
                 print(msg, file=sys.stderr)
                 msg = None
             extra = ''
+        if shard and not in_shard(package, shard):
+            continue
+        work.append((package, extra, verbose))
 
-        # Install package
+    journaled = read_journal(journal) if journal and resume else {}
+    log = Journal(journal, resume) if journal else None
+    todo = [job for job in work if job[0] not in journaled]
 
-        try:
-            install(package, skiplist)
-        except Exception as e:
-            print(f'Failed to install {package}: {e}', file=sys.stderr)
-            continue
+    names = [job[0] for job in todo]
+    run = RunProfile()
+    cached = get_cached(todo, cachedir) if cachedir and not unpack else None
+    if cached is not None:
+        units = []
+    elif batch > 1 and not unpack:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as resolver, timed(run.timings, 'plan'):
+            units = plan_batches(list(resolver.map(resolve_closure, names)), batch)
+    else:
+        units = [[i] for i in range(len(todo))]
 
-        # Get attributes
+    executor = None
+    cache = None
+    if cached is not None:
+        # Everything is in the cache, so there's no need to look at the
+        # environment, ask pip or start pyright.
+        results = iter(cached)
+    elif jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        workdir = tempfile.TemporaryDirectory(prefix='typescore-')
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                       initargs=(workdir.name, settings, jobs))
+        # Start the longest units first, but still hand the results back in input order.
+        durations, memory = get_history(names, cachedir)
+        ordered = longest_first(units, estimate_durations(names, durations, _wheelhouse))
 
-        cpackage = normalize_name(package)
-        typed = os.path.exists(f'{site_packages}/{cpackage}/py.typed')
-        ver = ''
-        description = ''
-        stubs = ''
-        if verbose:
-            try:
-                ver = version(package)
-                stubs = str(get_stub_package(package))
-                description = metadata(package)['Summary']
-                if description.find(sep) >= 0:
-                    description = '"' + description.replace('"', "'") + '"'
-            except Exception as e:
-                pass
-
-        paths = get_toplevels(package)
-        if len(paths) == 1:
-            nm_path = namespace_module_resolve(site_packages, package, paths[0])
-            if nm_path:
-                paths = [nm_path]
-
-        # Iterate through toplevel modules to get scores
-
-        for subpath in paths:
-            module = subpath.replace('/', '.')
-            hacky = False
-            if os.path.exists(f'{site_packages}/{subpath.replace("-", "_")}.py') and \
-                not os.path.exists(f'{site_packages}/{subpath}'):
-                # We have to do some hoop jumping here to get around
-                # pyright wanting a py.typed file before it will
-                # allow --verifytypes to be used. We already cons
-                # up a py.typed file if needed elsewhere, but we
-                # need to convert the package to a folder-based one
-                # temporarily here...
-                single_file_to_folder(site_packages, subpath)
-                typed = False
-                hacky = True
-            else:
-                typed = os.path.exists(f'{site_packages}/{subpath}/py.typed')
+        def submit(unit: list[int]) -> 'Future':
+            future = executor.submit(_score_in_worker, [todo[i] for i in unit])
+            if log:
+                # Journal the unit as soon as it is done, rather than when its
+                # turn comes in the output, so that a crash loses as little as it can.
+                future.add_done_callback(lambda f: _journal_unit(log, [todo[i][0] for i in unit], f))
+            return future
 
-            if os.path.exists(f'{site_packages}/{subpath}'):
-                score = get_score(package, subpath)
-                if verbose:
-                    result = f'{package}{sep}{ver}{sep}{typed}{sep}{module}{sep}{score}{sep}{stubs}{sep}{description}{extra}'
-                else:
-                    result = f'{package}{sep}{typed}{sep}{module}{sep}{score}{extra}'
-                if of:
-                    of.write(result)
-                    of.write('\n')
-                else:
-                    print(result)
+        if memory_budget:
+            admission = MemoryAdmission(ordered, estimate_memory(names, memory), memory_budget, jobs, submit)
+            results = _in_order(len(todo), units, admission.result)
+        else:
+            futures = {tuple(unit): submit(unit) for unit in ordered}
+            results = _in_order(len(todo), units, lambda unit: futures[tuple(unit)].result())
+    else:
+        skiplist = get_skiplist()
+        analyzer = make_analyzer()
+        cache = ResultCache(cachedir) if cachedir else None
+        if prefetch > 0 and len(units) == len(todo):
+            # Get the next packages ready while this one is being scored.
+            from .pipeline import pipelined
+            pyright = analyzer.version or pyright_version()
+            results = pipelined(todo, lambda job: prepare_package(*job, skiplist, pyright, cache, fetch=True),
+                                lambda prepared: finish_package(prepared, skiplist, analyzer, cache), prefetch,
+                                discard_prepared)
+        else:
+            results = _in_order(len(todo), units,
+                                lambda unit: score_batch([todo[i] for i in unit], skiplist, analyzer, cache))
+
+    try:
+        for package, extra, _ in work:
+            if package in journaled:
+                result = journaled[package]
+                if result:
+                    result.extra = extra
             else:
-                print(f'Package {package} module {module} not found in site packages', file=sys.stderr)
-            if hacky:
-                folder_to_single_file(site_packages, subpath)
-                
-        try:
-            cleanup(skiplist)
-        except Exception as e:
-            print(e, file=sys.stderr)
-            
-    if of:
-        of.close()
+                result = next(results)
+                if log and not executor:  # The workers' results were journaled as they finished.
+                    log.record(package, result)
+                if result:
+                    run.add(result)
+            if result is None:
+                continue
+            for sink in sinks:
+                sink.write(result)
+    finally:
+        if hasattr(results, 'close'):
+            results.close()  # Stop the pipeline (if any) before we close the cache it uses
+        if executor:
+            executor.shutdown(cancel_futures=True)
+            workdir.cleanup()
+        if cache:
+            cache.close()
+        if log:
+            log.close()
+        print(run.summary(), file=sys.stderr)
+        if profile:
+            run.write(profile)
+        for sink in sinks:
+            sink.close()
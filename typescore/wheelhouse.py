@@ -0,0 +1,143 @@
+import glob
+import os
+import shutil
+import subprocess
+import sys
+from typing import TYPE_CHECKING
+from packaging.utils import InvalidWheelFilename, canonicalize_name, parse_wheel_filename
+
+# zipfile, email.parser and most of packaging are imported by the functions
+# that use them, as they are slow to import and a run whose scores all come
+# from the cache doesn't need them.
+if TYPE_CHECKING:
+    from packaging.requirements import Requirement
+
+
+def pip_options(wheelhouse: str) -> list[str]:
+    """ Get the pip options to install only from the wheels in wheelhouse. """
+    return ["--no-index", "--find-links", os.path.abspath(wheelhouse)]
+
+
+def fetch_wheels(packages: list[str], wheelhouse: str, python: str=sys.executable) -> list[str]:
+    """ Download wheels for each package and its dependencies into wheelhouse,
+        building them from source distributions where there is no wheel.
+        Wheels already in wheelhouse are reused. Returns the packages that
+        failed.
+    """
+    os.makedirs(wheelhouse, exist_ok=True)
+    failed = []
+    for package in packages:
+        # One package at a time, so that one that can't be built or
+        # resolved doesn't stop the rest from being fetched.
+        try:
+            subprocess.run([python, "-m", "pip", "wheel", package, "--wheel-dir", wheelhouse,
+                            "--find-links", wheelhouse], capture_output=True, check=True)
+        except subprocess.CalledProcessError as e:
+            print(f'Failed to fetch {package}: {e}', file=sys.stderr)
+            failed.append(package)
+    return failed
+
+
+def find_wheel(package: str, wheelhouse: str) -> str|None:
+    """ Find the newest wheel for package in wheelhouse that this interpreter
+        can use, preferring the most specific tags. Returns None if there isn't one.
+    """
+    name = canonicalize_name(package)
+    from packaging.tags import sys_tags
+    priority = {tag: i for i, tag in enumerate(sys_tags())}
+    best = None
+    best_key = None
+    for filename in os.listdir(wheelhouse):
+        if not filename.endswith('.whl'):
+            continue
+        try:
+            wname, ver, _, tags = parse_wheel_filename(filename)
+        except InvalidWheelFilename:
+            continue
+        ranks = [priority[tag] for tag in tags if tag in priority]
+        if wname != name or not ranks:
+            continue
+        key = (ver, -min(ranks))
+        if best_key is None or key > best_key:
+            best, best_key = filename, key
+    return os.path.join(wheelhouse, best) if best else None
+
+
+def wheel_version(wheel: str) -> str:
+    """ Get the package version from a wheel file name. """
+    return str(parse_wheel_filename(os.path.basename(wheel))[1])
+
+
+def wheel_requirements(wheel: str) -> list['Requirement']:
+    """ Get the requirements of a wheel that apply to this interpreter,
+        ignoring those that are only needed for extras.
+    """
+    import zipfile
+    from email.parser import Parser
+    from packaging.requirements import Requirement
+    with zipfile.ZipFile(wheel) as zf:
+        names = [n for n in zf.namelist() if n.count('/') == 1 and n.endswith('.dist-info/METADATA')]
+        if not names:
+            return []
+        metadata = Parser().parsestr(zf.read(names[0]).decode('utf-8'))
+    reqs = []
+    for line in metadata.get_all('Requires-Dist') or []:
+        req = Requirement(line)
+        if req.marker is None or req.marker.evaluate({'extra': ''}):
+            reqs.append(req)
+    return reqs
+
+
+def unpack_wheel(wheel: str, target: str) -> None:
+    """ Unpack a wheel into target the way an install into site-packages would
+        lay it out, without running any install steps.
+    """
+    import zipfile
+    with zipfile.ZipFile(wheel) as zf:
+        zf.extractall(target)
+    # Anything in the .data folder's purelib or platlib belongs in site-packages too.
+    for data in glob.glob(f'{target}/*.data'):
+        for lib in ('purelib', 'platlib'):
+            src = os.path.join(data, lib)
+            if os.path.isdir(src):
+                shutil.copytree(src, target, dirs_exist_ok=True)
+        shutil.rmtree(data)
+
+
+def unpack_package(package: str, wheelhouse: str, target: str, deps: bool=False) -> str:
+    """ Unpack the wheel for package from wheelhouse into target, along with
+        the wheels of all its dependencies if deps is true. Returns the version
+        of the package. Raises FileNotFoundError if there is no wheel for it.
+    """
+    wheel = find_wheel(package, wheelhouse)
+    if wheel is None:
+        raise FileNotFoundError(f'No wheel for {package} in {wheelhouse}')
+    seen = {canonicalize_name(package)}
+    todo = [wheel]
+    while todo:
+        w = todo.pop()
+        unpack_wheel(w, target)
+        if not deps:
+            break
+        for req in wheel_requirements(w):
+            name = canonicalize_name(req.name)
+            if name in seen:
+                continue
+            seen.add(name)
+            dep = find_wheel(req.name, wheelhouse)
+            if dep:
+                todo.append(dep)
+            else:
+                print(f'{package}: no wheel for dependency {req.name}', file=sys.stderr)
+    return wheel_version(wheel)
+
+
+def build_wheels(package: str, dest: str, deps: bool=False, python: str=sys.executable,
+                 options: list[str]|None=None) -> None:
+    """ Download or build the wheel for package (and its dependencies if deps
+        is true) into dest. Raises a CalledProcessError on failure.
+    """
+    cmd = [python, "-m", "pip", "wheel", package, "--wheel-dir", dest]
+    if not deps:
+        cmd.append("--no-deps")
+    subprocess.run(cmd + (options or []), capture_output=True, check=True)